@@ -0,0 +1,1131 @@
+from abc import ABC, abstractmethod
+from array import array
+import asyncio
+from collections import defaultdict
+import heapq
+import math
+import multiprocessing
+from operator import itemgetter
+import os
+import sqlite3
+import time
+
+import numpy as np
+import orjson
+
+from db import backfill_derived_columns, ensure_tables
+from derived import count_occurrences, get_emoji_code
+from downloader import enqueue_downloads, run_downloads
+from sidecar import (
+    DERIVED_COLUMNS,
+    SIDECAR_COLUMNS,
+    get_sidecar_arrays,
+    get_sidecar_range,
+    open_sidecar,
+)
+from word_codec import WORD_USAGE_HEADER, decode_word_usage, encode_word_usage
+
+CURRENT_YEAR = int(os.environ.get("CURRENT_YEAR", "2025"))
+AGGREGATORS = os.environ.get("AGGREGATORS", "buckets,words,users").split(",")
+AGGREGATE_WORKERS = int(os.environ.get("AGGREGATE_WORKERS", "1"))
+AGGREGATE_DELTA = os.environ.get("AGGREGATE_DELTA", "0") == "1"
+# 0 keeps an exact per-day series for every word. Otherwise only the top K words
+# get one, picked from ceil(1 / WORD_ERROR) tracked candidates
+WORD_TOP_K = int(os.environ.get("WORD_TOP_K", "0"))
+WORD_ERROR = float(os.environ.get("WORD_ERROR", "0.0001"))
+DOWNLOAD_MEDIA = os.environ.get("DOWNLOAD_MEDIA", "1") == "1"
+# upper bound on the rows fetched from sqlite at a time, the aggregates
+# themselves aren't counted
+AGGREGATE_FETCH_MB = int(os.environ.get("AGGREGATE_FETCH_MB", "64"))
+# read array columns from the memory mapped sidecar process.py writes, when
+# it matches the database
+AGGREGATE_SIDECAR = os.environ.get("AGGREGATE_SIDECAR", "1") == "1"
+SAMPLE_ROWS = 1000
+MAX_CHUNK_ROWS = 100000
+
+# columns stored as JSON, decoded once per row no matter how many aggregators
+# read them
+JSON_COLUMNS = {"attachments", "reactions", "mentions", "inline_emojis"}
+# dtypes of the columns handed to add_arrays, int64 unless listed
+ARRAY_DTYPES = {"author_name": object}
+DAY_SECONDS = 86400
+# slots of an emoji's per user [inline, reactions] counts
+INLINE = 0
+REACTIONS = 1
+DB_PATH = "backend/wrapped.db"
+IN_CHUNK_SIZE = 500
+
+
+class Aggregator(ABC):
+    # columns read row by row through add(), and columns read once per chunk
+    # as numpy arrays through add_arrays(), after every row of the chunk
+    columns: tuple = ()
+    array_columns: tuple = ()
+
+    def add(self, row: dict):
+        pass
+
+    def add_arrays(self, arrays: dict):
+        pass
+
+    def finish(self):
+        # called once the scan is done, before merging or writing
+        pass
+
+    @abstractmethod
+    def merge(self, other: "Aggregator"):
+        # folds in the partial result of a later shard, or of the messages
+        # past the watermark in delta mode
+        pass
+
+    @abstractmethod
+    def load(self, conn: sqlite3.Connection, year: int, delta: "Aggregator"):
+        # reads back the stored aggregates for the keys delta touched
+        pass
+
+    def write(self, conn: sqlite3.Connection, year: int, replace: bool):
+        pass
+
+
+def iter_chunks(items: list, size: int = IN_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def get_placeholders(items: list) -> str:
+    return ", ".join("?" * len(items))
+
+
+class BucketAggregator(Aggregator):
+    array_columns = ("day_bucket", "total_reactions", "mention_count")
+
+    def __init__(self):
+        self.message_buckets = defaultdict(int)
+        self.reaction_buckets = defaultdict(int)
+        self.mention_buckets = defaultdict(int)
+
+    def add_arrays(self, arrays: dict):
+        first_day = arrays["day_bucket"].min()
+        days = (arrays["day_bucket"] - first_day) // DAY_SECONDS
+        messages = np.bincount(days)
+        reactions = np.bincount(days, weights=arrays["total_reactions"])
+        mentions = np.bincount(days, weights=arrays["mention_count"])
+        first_index = np.full(len(messages), len(days))
+        np.minimum.at(first_index, days, np.arange(len(days)))
+        # new days are added in the order they first appear, like a row by
+        # row pass would
+        present = np.flatnonzero(messages)
+        for day in present[np.argsort(first_index[present], kind="stable")].tolist():
+            timestamp_bucket = str(int(first_day) + day * DAY_SECONDS)
+            self.message_buckets[timestamp_bucket] += int(messages[day])
+            self.reaction_buckets[timestamp_bucket] += int(reactions[day])
+            self.mention_buckets[timestamp_bucket] += int(mentions[day])
+
+    def merge(self, other: "BucketAggregator"):
+        merge_counts(self.message_buckets, other.message_buckets)
+        merge_counts(self.reaction_buckets, other.reaction_buckets)
+        merge_counts(self.mention_buckets, other.mention_buckets)
+
+    def load(self, conn: sqlite3.Connection, year: int, delta: "BucketAggregator"):
+        for key, value in conn.execute(
+            "SELECT key, value FROM static WHERE year = ? AND key IN ('message_buckets', 'reaction_buckets', 'mention_buckets')",
+            (year,),
+        ):
+            getattr(self, key).update(orjson.loads(value))
+
+    def write(self, conn: sqlite3.Connection, year: int, replace: bool):
+        conn.executemany(
+            "INSERT OR REPLACE INTO static (key, value, year) VALUES (?, ?, ?)",
+            [
+                ("message_buckets", orjson.dumps(self.message_buckets), year),
+                ("reaction_buckets", orjson.dumps(self.reaction_buckets), year),
+                ("mention_buckets", orjson.dumps(self.mention_buckets), year),
+            ],
+        )
+
+
+class WordAggregator(Aggregator):
+    columns = ("content", "day_bucket")
+
+    def __init__(self):
+        self.word_cache = {}
+
+    def add(self, row: dict):
+        timestamp_bucket = str(row["day_bucket"])
+        word_cache = self.word_cache
+        for word in iter_words(row["content"]):
+            if word not in word_cache:
+                word_cache[word] = {"total": 0, "buckets": defaultdict(int)}
+
+            word_cache[word]["total"] += 1
+            word_cache[word]["buckets"][timestamp_bucket] += 1
+
+    def merge(self, other: "WordAggregator"):
+        word_cache = self.word_cache
+        for word, data in other.word_cache.items():
+            if word not in word_cache:
+                word_cache[word] = data
+                continue
+            word_cache[word]["total"] += data["total"]
+            merge_counts(word_cache[word]["buckets"], data["buckets"])
+
+    def load(self, conn: sqlite3.Connection, year: int, delta: "WordAggregator"):
+        for words in iter_chunks(list(delta.word_cache)):
+            for word, data in conn.execute(
+                f"SELECT word, data FROM word_usage WHERE year = ? AND word IN ({get_placeholders(words)})",
+                (year, *words),
+            ):
+                self.word_cache[word] = decode_word_usage(data)
+
+    def write(self, conn: sqlite3.Connection, year: int, replace: bool):
+        print(f"Writing word usage ({len(self.word_cache)})")
+        conn.executemany(
+            "INSERT OR REPLACE INTO word_usage (word, data, year) VALUES (?, ?, ?)",
+            (
+                (word, encode_word_usage(data), year)
+                for word, data in self.word_cache.items()
+            ),
+        )
+
+
+class TopWordAggregator(Aggregator):
+    # Space-Saving style heavy hitters. Totals stay exact for every word, but
+    # per-day series are only kept for a bounded set of tracked words. An
+    # untracked word replaces the tracked word with the lowest total once its
+    # own total is higher, and its series starts from that message. Tracked
+    # totals sum to at most the number of words seen, so a series misses at
+    # most WORD_ERROR of all words seen
+    columns = ("content", "day_bucket")
+
+    def __init__(self, top_k: int = WORD_TOP_K, error: float = WORD_ERROR):
+        self.top_k = top_k
+        self.capacity = max(top_k, math.ceil(1 / error))
+        self.totals = defaultdict(int)
+        self.series = {}
+        # one (total, word) entry per tracked word, the total may be stale
+        self.heap = []
+
+    def get_min_tracked(self) -> str:
+        while True:
+            total, word = self.heap[0]
+            current = self.totals[word]
+            if total == current:
+                return word
+            heapq.heapreplace(self.heap, (current, word))
+
+    def track(self, word: str):
+        if len(self.series) >= self.capacity:
+            min_word = self.get_min_tracked()
+            if self.totals[word] <= self.totals[min_word]:
+                return
+            heapq.heappop(self.heap)
+            del self.series[min_word]
+        self.series[word] = defaultdict(int)
+        heapq.heappush(self.heap, (self.totals[word], word))
+
+    def add(self, row: dict):
+        timestamp_bucket = str(row["day_bucket"])
+        totals = self.totals
+        series = self.series
+        for word in iter_words(row["content"]):
+            totals[word] += 1
+            if word not in series:
+                self.track(word)
+                if word not in series:
+                    continue
+            series[word][timestamp_bucket] += 1
+
+    def trim(self):
+        if len(self.series) > self.capacity:
+            kept = heapq.nlargest(
+                self.capacity, self.series, key=lambda word: self.totals[word]
+            )
+            self.series = {word: self.series[word] for word in kept}
+        self.heap = [(self.totals[word], word) for word in self.series]
+        heapq.heapify(self.heap)
+
+    def merge(self, other: "TopWordAggregator"):
+        merge_counts(self.totals, other.totals)
+        for word, buckets in other.series.items():
+            if word in self.series:
+                merge_counts(self.series[word], buckets)
+            else:
+                self.series[word] = buckets
+        self.trim()
+
+    def load(self, conn: sqlite3.Connection, year: int, delta: "TopWordAggregator"):
+        def add_rows(rows):
+            for word, data in rows:
+                data = decode_word_usage(data)
+                self.totals[word] = data["total"]
+                if data["buckets"]:
+                    self.series[word] = data["buckets"]
+
+        # the words that have daily counts stored too, so write can clear
+        # those that drop out of the top K. a row without them is only the
+        # header
+        add_rows(
+            conn.execute(
+                "SELECT word, data FROM word_usage WHERE year = ? AND length(data) > ?",
+                (year, WORD_USAGE_HEADER.size),
+            )
+        )
+        for words in iter_chunks(
+            [word for word in delta.totals if word not in self.totals]
+        ):
+            add_rows(
+                conn.execute(
+                    f"SELECT word, data FROM word_usage WHERE year = ? AND word IN ({get_placeholders(words)})",
+                    (year, *words),
+                )
+            )
+        self.trim()
+
+    def write(self, conn: sqlite3.Connection, year: int, replace: bool):
+        top_words = set(
+            heapq.nlargest(self.top_k, self.series, key=lambda word: self.totals[word])
+        )
+        print(
+            f"Writing word usage ({len(self.totals)}, {len(top_words)} with daily counts)"
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO word_usage (word, data, year) VALUES (?, ?, ?)",
+            (
+                (
+                    word,
+                    encode_word_usage(
+                        {
+                            "total": total,
+                            "buckets": (self.series[word] if word in top_words else {}),
+                        }
+                    ),
+                    year,
+                )
+                for word, total in self.totals.items()
+            ),
+        )
+
+
+def iter_words(content: str):
+    for word in content.replace("\n", " ").split(" "):
+        if word != "":
+            yield word.lower()
+
+
+def merge_counts(counts: dict, other: dict):
+    # new keys are appended in the other shard's order, so merging shards in
+    # message order gives the same key order as a single pass
+    for key, count in other.items():
+        counts[key] = counts.get(key, 0) + count
+
+
+def is_counted_author(row: dict) -> bool:
+    return bool(row["author_id"]) and row["author_name"] != "Deleted User"
+
+
+class EmojiAggregator(Aggregator):
+    # per user emoji usage, written out as part of each user's row
+    columns = ("author_id", "author_name", "content", "inline_emojis", "reactions")
+
+    def __init__(self):
+        # emoji ids are numbered in first seen order and stored once, each
+        # user maps the numbers to [inline, reactions] counts
+        self.emoji_ids = []
+        self.emoji_flags = []
+        self.emoji_index = {}
+        self.user_emojis = defaultdict(dict)
+
+    def get_emoji_index(self, emoji_id: str, native: bool, animated: bool) -> int:
+        index = self.emoji_index.get(emoji_id)
+        if index is None:
+            index = len(self.emoji_ids)
+            self.emoji_index[emoji_id] = index
+            self.emoji_ids.append(emoji_id)
+            self.emoji_flags.append((native, animated))
+        return index
+
+    def count(self, user_id: int, emoji: dict, kind: int, amount: int):
+        index = self.get_emoji_index(
+            emoji["id"] or emoji["name"], emoji["id"] == "", emoji["isAnimated"]
+        )
+        emojis = self.user_emojis[user_id]
+        counts = emojis.get(index)
+        if counts is None:
+            counts = emojis[index] = [0, 0]
+        counts[kind] += amount
+
+    def add(self, row: dict):
+        if not is_counted_author(row):
+            return
+
+        user_id = int(row["author_id"])
+        content = row["content"]
+        inline_emojis = row["inline_emojis"]
+        if inline_emojis:
+            counts = count_occurrences(
+                content, [get_emoji_code(emoji) for emoji in inline_emojis]
+            )
+            for emoji in inline_emojis:
+                self.count(user_id, emoji, INLINE, counts[get_emoji_code(emoji)])
+
+        for reaction in row["reactions"]:
+            for user in reaction["users"]:
+                if user["isBot"] or user["name"] == "Deleted User":
+                    continue
+                self.count(int(user["id"]), reaction["emoji"], REACTIONS, 1)
+
+    def merge(self, other: "EmojiAggregator"):
+        # the other side numbered its emojis on its own
+        for user_id, other_emojis in other.user_emojis.items():
+            emojis = self.user_emojis[user_id]
+            for other_index, other_counts in other_emojis.items():
+                index = self.get_emoji_index(
+                    other.emoji_ids[other_index], *other.emoji_flags[other_index]
+                )
+                counts = emojis.get(index)
+                if counts is None:
+                    emojis[index] = other_counts
+                    continue
+                counts[INLINE] += other_counts[INLINE]
+                counts[REACTIONS] += other_counts[REACTIONS]
+
+    def load(self, conn: sqlite3.Connection, year: int, delta: "EmojiAggregator"):
+        # stored as part of the users rows, UserAggregator.load reads it back
+        pass
+
+    def load_user(self, user_id: int, emoji_data: dict):
+        emojis = self.user_emojis[user_id]
+        for emoji_id, emoji in emoji_data.items():
+            index = self.get_emoji_index(emoji_id, emoji["native"], emoji["animated"])
+            emojis[index] = [emoji["inline"], emoji["reactions"]]
+
+    def get_emoji_data(self, user_id: int) -> dict:
+        emoji_data = {}
+        for index, counts in self.user_emojis.get(user_id, {}).items():
+            native, animated = self.emoji_flags[index]
+            emoji_data[self.emoji_ids[index]] = {
+                "inline": counts[INLINE],
+                "reactions": counts[REACTIONS],
+                "native": native,
+                "animated": animated,
+            }
+        return emoji_data
+
+
+class UserRecord:
+    # the name, nickname and avatar are the ones the user was first seen with
+    __slots__ = (
+        "name",
+        "nickname",
+        "avatar_url",
+        "messages",
+        "reactions_given",
+        "reactions_received",
+        "attachments_sent",
+        "attachments_size",
+        "hour_counts",
+        "hour_order",
+        "mentions_given",
+        "mentions_received",
+    )
+
+    def __init__(self, name: str, nickname: str, avatar_url: str):
+        self.name = name
+        self.nickname = nickname
+        self.avatar_url = avatar_url
+        self.messages = 0
+        self.reactions_given = 0
+        self.reactions_received = 0
+        self.attachments_sent = 0
+        self.attachments_size = 0
+        # messages per hour of day, and the hours in first appearance order so
+        # ties for the most frequent hour resolve the same way after a merge
+        self.hour_counts = array("I", bytes(24 * 4))
+        self.hour_order = bytearray()
+        # user id to Mention
+        self.mentions_given = {}
+        self.mentions_received = {}
+
+    def add_hour(self, hour: int, count: int):
+        if self.hour_counts[hour] == 0:
+            self.hour_order.append(hour)
+        self.hour_counts[hour] += count
+
+    def get_msg_frequency(self) -> dict:
+        return {hour: self.hour_counts[hour] for hour in self.hour_order}
+
+
+class Mention:
+    # one per pair of users, shared by the mentioning user's mentions_given and
+    # the mentioned user's mentions_received
+    __slots__ = ("count", "first_message_id", "first_position")
+
+    def __init__(self, first_message_id: int, first_position: int, count: int = 0):
+        self.count = count
+        self.first_message_id = first_message_id
+        self.first_position = first_position
+
+
+class UserAggregator(Aggregator):
+    columns = (
+        "author_id",
+        "author_name",
+        "author_nickname",
+        "author_avatar_url",
+        "attachments",
+        "reactions",
+        "mentions",
+        "message_id",
+    )
+    array_columns = ("author_id", "author_name", "hour_of_day", "total_reactions")
+
+    def __init__(self, emojis: EmojiAggregator):
+        self.emojis = emojis
+        self.user_cache = {}
+        # names of users at the other end of loaded edges who weren't loaded
+        # themselves, delta mode only
+        self.names = {}
+        self.reset_arrays()
+
+    def init_user(self, user_id, user_name, user_nickname, avatar_url) -> UserRecord:
+        user = self.user_cache.get(user_id)
+        if user is None:
+            user = self.user_cache[user_id] = UserRecord(
+                user_name, user_nickname, avatar_url
+            )
+        return user
+
+    def get_name(self, user_id: int) -> str:
+        user = self.user_cache.get(user_id)
+        return user.name if user is not None else self.names[user_id]
+
+    def add(self, row: dict):
+        if not is_counted_author(row):
+            return
+
+        user_id = int(row["author_id"])
+        # message counts, hours and reactions received are added per chunk in
+        # add_arrays
+        author = self.init_user(
+            user_id,
+            row["author_name"],
+            row["author_nickname"],
+            row["author_avatar_url"],
+        )
+
+        for reaction in row["reactions"]:
+            for user in reaction["users"]:
+                if user["isBot"] or user["name"] == "Deleted User":
+                    continue
+                reactor = self.init_user(
+                    int(user["id"]), user["name"], user["nickname"], user["avatarUrl"]
+                )
+                reactor.reactions_given += 1
+
+        for position, mention in enumerate(row["mentions"]):
+            if mention["isBot"] or mention["name"] == "Deleted User":
+                continue
+
+            mentioned_id = int(mention["id"])
+            mentioned = self.init_user(
+                mentioned_id,
+                mention["name"],
+                mention["nickname"],
+                mention["avatarUrl"],
+            )
+
+            edge = author.mentions_given.get(mentioned_id)
+            if edge is None:
+                edge = Mention(row["message_id"], position)
+                author.mentions_given[mentioned_id] = edge
+                mentioned.mentions_received[user_id] = edge
+            edge.count += 1
+
+        for attachment in row["attachments"]:
+            author.attachments_sent += 1
+            author.attachments_size += attachment["fileSizeBytes"]
+
+    def reset_arrays(self):
+        # dense per author state filled by add_arrays, indexed by the order
+        # authors were first seen
+        self.author_ids = np.empty(0, dtype=np.int64)
+        self.sorted_ids = np.empty(0, dtype=np.int64)
+        self.sorted_index = np.empty(0, dtype=np.int64)
+        self.hour_counts = np.zeros((0, 24), dtype=np.int64)
+        self.first_seen = np.zeros((0, 24), dtype=np.int64)
+        self.received = np.zeros(0, dtype=np.int64)
+        self.position = 0
+
+    def get_author_index(self, author_ids: np.ndarray) -> np.ndarray:
+        positions = np.searchsorted(self.sorted_ids, author_ids)
+        known = np.zeros(len(author_ids), dtype=bool)
+        if len(self.sorted_ids) > 0:
+            clipped = np.minimum(positions, len(self.sorted_ids) - 1)
+            known = self.sorted_ids[clipped] == author_ids
+        if not known.all():
+            new_ids = np.unique(author_ids[~known])
+            self.author_ids = np.concatenate([self.author_ids, new_ids])
+            self.sorted_index = np.argsort(self.author_ids)
+            self.sorted_ids = self.author_ids[self.sorted_index]
+            self.hour_counts = np.vstack(
+                [self.hour_counts, np.zeros((len(new_ids), 24), dtype=np.int64)]
+            )
+            self.first_seen = np.vstack(
+                [
+                    self.first_seen,
+                    np.full((len(new_ids), 24), np.iinfo(np.int64).max),
+                ]
+            )
+            self.received = np.concatenate(
+                [self.received, np.zeros(len(new_ids), dtype=np.int64)]
+            )
+            positions = np.searchsorted(self.sorted_ids, author_ids)
+        return self.sorted_index[positions]
+
+    def add_arrays(self, arrays: dict):
+        counted = np.flatnonzero(
+            (arrays["author_id"] != 0) & (arrays["author_name"] != "Deleted User")
+        )
+        author_index = self.get_author_index(arrays["author_id"][counted])
+        slots = author_index * 24 + arrays["hour_of_day"][counted]
+        self.hour_counts += np.bincount(slots, minlength=self.hour_counts.size).reshape(
+            -1, 24
+        )
+        np.minimum.at(self.first_seen.reshape(-1), slots, self.position + counted)
+        self.received += np.bincount(
+            author_index,
+            weights=arrays["total_reactions"][counted],
+            minlength=len(self.received),
+        ).astype(np.int64)
+        self.position += len(arrays["author_id"])
+
+    def finish(self):
+        for index, user_id in enumerate(self.author_ids.tolist()):
+            user = self.user_cache[user_id]
+            hour_counts = self.hour_counts[index]
+            user.messages += int(hour_counts.sum())
+            user.reactions_received += int(self.received[index])
+            # hours in first appearance order, so the hour picked on ties
+            # matches a row by row pass
+            hours = np.flatnonzero(hour_counts)
+            order = np.argsort(self.first_seen[index][hours], kind="stable")
+            for hour in hours[order].tolist():
+                user.add_hour(hour, int(hour_counts[hour]))
+        self.reset_arrays()
+
+    def merge(self, other: "UserAggregator"):
+        # the emoji aggregator this one reads from is merged on its own
+        self.names.update(other.names)
+        for user_id, other_user in other.user_cache.items():
+            if user_id not in self.user_cache:
+                self.user_cache[user_id] = other_user
+                continue
+
+            user = self.user_cache[user_id]
+            user.messages += other_user.messages
+            user.reactions_given += other_user.reactions_given
+            user.reactions_received += other_user.reactions_received
+            user.attachments_sent += other_user.attachments_sent
+            user.attachments_size += other_user.attachments_size
+            for hour in other_user.hour_order:
+                user.add_hour(hour, other_user.hour_counts[hour])
+            # both sides hold the same Mention, so counts are only added on the
+            # mentions_given side
+            for mentioned_id, edge in other_user.mentions_given.items():
+                if mentioned_id not in user.mentions_given:
+                    user.mentions_given[mentioned_id] = edge
+                else:
+                    user.mentions_given[mentioned_id].count += edge.count
+            for mentioned_id, edge in other_user.mentions_received.items():
+                if mentioned_id not in user.mentions_received:
+                    user.mentions_received[mentioned_id] = edge
+
+    def load(self, conn: sqlite3.Connection, year: int, delta: "UserAggregator"):
+        user_ids = list(delta.user_cache)
+        for chunk in iter_chunks(user_ids):
+            for row in conn.execute(
+                f"SELECT user_id, user_name, user_nickname, user_avatar_url, messages_sent, reactions_given, reactions_received, attachments_sent, attachments_size, msg_frequency, emoji_data FROM users WHERE year = ? AND user_id IN ({get_placeholders(chunk)})",
+                (year, *chunk),
+            ):
+                user = self.init_user(*row[:4])
+                user.messages = row[4]
+                user.reactions_given = row[5]
+                user.reactions_received = row[6]
+                user.attachments_sent = row[7]
+                user.attachments_size = row[8]
+                for hour, count in orjson.loads(row[9]).items():
+                    user.add_hour(int(hour), count)
+                self.emojis.load_user(row[0], orjson.loads(row[10]))
+
+        # edges in first mention order, the same order a full pass adds them in,
+        # so ties for most mentioned resolve the same way
+        edges = {}
+        for column, map_key in (
+            ("from_user_id", "mentions_given"),
+            ("to_user_id", "mentions_received"),
+        ):
+            for chunk in iter_chunks(user_ids):
+                for (
+                    from_id,
+                    to_id,
+                    from_name,
+                    to_name,
+                    count,
+                    first_id,
+                    first_position,
+                ) in conn.execute(
+                    f"SELECT from_user_id, to_user_id, from_name, to_name, count, first_message_id, first_position FROM mention_edges WHERE year = ? AND {column} IN ({get_placeholders(chunk)}) ORDER BY first_message_id ASC, first_position ASC",
+                    (year, *chunk),
+                ):
+                    if map_key == "mentions_given":
+                        user_id, other_id, other_name = from_id, to_id, to_name
+                    else:
+                        user_id, other_id, other_name = to_id, from_id, from_name
+                    if user_id not in self.user_cache:
+                        continue
+                    if other_id not in self.user_cache:
+                        self.names[other_id] = other_name
+                    edge = edges.get((from_id, to_id))
+                    if edge is None:
+                        edge = Mention(first_id, first_position, count)
+                        edges[(from_id, to_id)] = edge
+                    getattr(self.user_cache[user_id], map_key)[other_id] = edge
+
+    def get_user_row(self, user_id: int, user: UserRecord, year: int) -> tuple:
+        msg_frequency = user.get_msg_frequency()
+        most_frequent_time = (
+            max(msg_frequency, key=lambda x: msg_frequency[x])
+            if len(msg_frequency) > 0
+            else 0
+        )
+
+        mentions_given = user.mentions_given
+        mentions_given_count = sum(edge.count for edge in mentions_given.values())
+        most_mentioned_given_id = (
+            max(mentions_given, key=lambda x: mentions_given[x].count)
+            if len(mentions_given) > 0
+            else 0
+        )
+        most_mentioned_given_count = (
+            mentions_given[most_mentioned_given_id].count
+            if len(mentions_given) > 0
+            else 0
+        )
+        most_mentioned_given_name = (
+            self.get_name(most_mentioned_given_id) if len(mentions_given) > 0 else ""
+        )
+
+        mentions_received = user.mentions_received
+        mentions_received_count = sum(edge.count for edge in mentions_received.values())
+        most_mentioned_received_id = (
+            max(mentions_received, key=lambda x: mentions_received[x].count)
+            if len(mentions_received) > 0
+            else 0
+        )
+        most_mentioned_received_count = (
+            mentions_received[most_mentioned_received_id].count
+            if len(mentions_received) > 0
+            else 0
+        )
+        most_mentioned_received_name = (
+            self.get_name(most_mentioned_received_id)
+            if len(mentions_received) > 1
+            else ""
+        )
+
+        return (
+            user_id,
+            user.name,
+            user.nickname,
+            user.avatar_url,
+            mentions_received_count,
+            mentions_given_count,
+            user.reactions_received,
+            user.reactions_given,
+            user.messages,
+            user.attachments_sent,
+            user.attachments_size,
+            most_frequent_time,
+            most_mentioned_given_name,
+            most_mentioned_received_name,
+            most_mentioned_given_id,
+            most_mentioned_received_id,
+            most_mentioned_given_count,
+            most_mentioned_received_count,
+            orjson.dumps(self.emojis.get_emoji_data(user_id)),
+            year,
+            orjson.dumps(msg_frequency, option=orjson.OPT_NON_STR_KEYS),
+        )
+
+    def get_edge_rows(self, year: int):
+        for user_id, user in self.user_cache.items():
+            for mentioned_id, edge in user.mentions_given.items():
+                # in delta mode only edges with both ends loaded have changed
+                mentioned = self.user_cache.get(mentioned_id)
+                if mentioned is None or user_id not in mentioned.mentions_received:
+                    continue
+                yield (
+                    year,
+                    user_id,
+                    mentioned_id,
+                    user.name,
+                    mentioned.name,
+                    edge.count,
+                    edge.first_message_id,
+                    edge.first_position,
+                )
+
+    def write(self, conn: sqlite3.Connection, year: int, replace: bool):
+        print(f"Writing users ({len(self.user_cache)})")
+        if replace:
+            conn.execute("DELETE FROM users WHERE year = ?", (year,))
+            conn.execute("DELETE FROM mention_edges WHERE year = ?", (year,))
+        else:
+            # users has no unique key to replace on, idx_users_year_user_id
+            # makes this a lookup per user
+            conn.executemany(
+                "DELETE FROM users WHERE year = ? AND user_id = ?",
+                ((year, user_id) for user_id in self.user_cache),
+            )
+        conn.executemany(
+            "INSERT OR REPLACE INTO users (user_id, user_name, user_nickname, user_avatar_url, mentions_received, mentions_given, reactions_received, reactions_given, messages_sent, attachments_sent, attachments_size, most_frequent_time, most_mentioned_given_name, most_mentioned_received_name, most_mentioned_given_id, most_mentioned_received_id, most_mentioned_given_count, most_mentioned_received_count, emoji_data, year, msg_frequency) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.get_user_row(user_id, user, year)
+                for user_id, user in self.user_cache.items()
+            ),
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO mention_edges (year, from_user_id, to_user_id, from_name, to_name, count, first_message_id, first_position) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            self.get_edge_rows(year),
+        )
+        enqueue_downloads(
+            conn,
+            [
+                (f"avatars/{user.name}.png", user.avatar_url, "avatar", user_id)
+                for user_id, user in self.user_cache.items()
+                if user.avatar_url
+            ],
+        )
+
+
+def build_aggregators(names: list[str]) -> list[Aggregator]:
+    aggregators = []
+    if "buckets" in names:
+        aggregators.append(BucketAggregator())
+    if "words" in names:
+        aggregators.append(TopWordAggregator() if WORD_TOP_K else WordAggregator())
+    if "users" in names:
+        emojis = EmojiAggregator()
+        aggregators.extend([emojis, UserAggregator(emojis)])
+    return aggregators
+
+
+def get_chunk_size(rows: list[tuple]) -> int:
+    # sized from the first chunk so a chunk of average rows stays under
+    # AGGREGATE_FETCH_MB
+    row_size = sum(
+        len(value) if isinstance(value, (str, bytes)) else 8
+        for row in rows
+        for value in row
+    ) / len(rows)
+    return max(1, min(MAX_CHUNK_ROWS, int(AGGREGATE_FETCH_MB * 2**20 / row_size)))
+
+
+def get_arrays(rows: list[tuple], columns: list[str], wanted: set) -> dict:
+    return {
+        column: np.fromiter(
+            map(itemgetter(i), rows),
+            dtype=ARRAY_DTYPES.get(column, np.int64),
+            count=len(rows),
+        )
+        for i, column in enumerate(columns)
+        if column in wanted
+    }
+
+
+def scan_messages(
+    conn: sqlite3.Connection,
+    year: int,
+    aggregators: list[Aggregator],
+    id_range: tuple = (None, None),
+    label: str = "",
+):
+    columns = []
+    for aggregator in aggregators:
+        for column in aggregator.columns + aggregator.array_columns:
+            if column not in columns:
+                columns.append(column)
+    json_columns = [column for column in columns if column in JSON_COLUMNS]
+    row_aggregators = [aggregator for aggregator in aggregators if aggregator.columns]
+    array_columns = {
+        column for aggregator in aggregators for column in aggregator.array_columns
+    }
+
+    sidecar = open_sidecar(conn, year) if AGGREGATE_SIDECAR else None
+    sidecar_columns = set()
+    if sidecar is not None:
+        # columns that are only read as arrays and that the sidecar has aren't
+        # read from sqlite at all
+        row_columns = {
+            column for aggregator in row_aggregators for column in aggregator.columns
+        }
+        sidecar_columns = {
+            column
+            for column in array_columns - row_columns
+            if column in SIDECAR_COLUMNS or column in DERIVED_COLUMNS
+        }
+        columns = [column for column in columns if column not in sidecar_columns]
+        array_columns -= sidecar_columns
+        start, stop = get_sidecar_range(sidecar, id_range)
+        count = stop - start
+        print(f"{label}Reading {', '.join(sorted(sidecar_columns))} from the sidecar")
+        if columns and "message_id" not in columns:
+            # only read to check that sqlite and the sidecar line up
+            columns.append("message_id")
+    else:
+        conditions, params = get_range_conditions(year, id_range)
+        count = conn.execute(
+            f"SELECT COUNT(*) FROM messages WHERE {conditions}", params
+        ).fetchone()[0]
+
+    if not columns:
+        for position in range(start, stop, MAX_CHUNK_ROWS):
+            chunk_end = min(position + MAX_CHUNK_ROWS, stop)
+            arrays = get_sidecar_arrays(sidecar, position, chunk_end, sidecar_columns)
+            for aggregator in aggregators:
+                aggregator.add_arrays(arrays)
+            print(f"{label}{chunk_end - start}/{count}")
+        for aggregator in aggregators:
+            aggregator.finish()
+        return
+
+    conditions, params = get_range_conditions(year, id_range)
+    # message ids are snowflakes, so rowid order is timestamp order and sqlite
+    # can walk idx_messages_year without sorting the whole year first
+    cursor = conn.execute(
+        f"SELECT {', '.join(columns)} FROM messages WHERE {conditions} ORDER BY message_id ASC",
+        params,
+    )
+    processed = 0
+    chunk_size = SAMPLE_ROWS
+    while rows := cursor.fetchmany(chunk_size):
+        if row_aggregators:
+            for values in rows:
+                row = dict(zip(columns, values))
+                for column in json_columns:
+                    row[column] = orjson.loads(row[column])
+                for aggregator in row_aggregators:
+                    aggregator.add(row)
+
+        arrays = get_arrays(rows, columns, array_columns)
+        if sidecar is not None:
+            position = start + processed
+            check_sidecar(sidecar, position, rows, columns.index("message_id"))
+            arrays.update(
+                get_sidecar_arrays(
+                    sidecar, position, position + len(rows), sidecar_columns
+                )
+            )
+        if arrays:
+            for aggregator in aggregators:
+                aggregator.add_arrays(arrays)
+
+        if processed == 0:
+            chunk_size = get_chunk_size(rows)
+        processed += len(rows)
+        print(f"{label}{processed}/{count}")
+
+    for aggregator in aggregators:
+        aggregator.finish()
+
+
+def check_sidecar(sidecar: dict, position: int, rows: list[tuple], id_index: int):
+    # the sidecar matched the message count and max id when it was opened, so
+    # a mismatch here means rows were replaced since it was written
+    message_ids = sidecar["message_id"]
+    if (
+        position + len(rows) > len(message_ids)
+        or message_ids[position] != rows[0][id_index]
+        or message_ids[position + len(rows) - 1] != rows[-1][id_index]
+    ):
+        raise RuntimeError(
+            "The sidecar doesn't match the messages table, rerun process.py or set AGGREGATE_SIDECAR=0"
+        )
+
+
+def get_range_conditions(year: int, id_range: tuple) -> tuple[str, tuple]:
+    conditions = ["year = ?"]
+    params = [year]
+    low, high = id_range
+    if low is not None:
+        conditions.append("message_id >= ?")
+        params.append(low)
+    if high is not None:
+        conditions.append("message_id < ?")
+        params.append(high)
+    return " AND ".join(conditions), tuple(params)
+
+
+def get_shard_ranges(
+    conn: sqlite3.Connection, year: int, count: int, shards: int, end: int
+) -> list[tuple]:
+    # splits the year into message id ranges with about the same number of
+    # messages in each
+    bounds = [None]
+    for i in range(1, shards):
+        row = conn.execute(
+            "SELECT message_id FROM messages WHERE year = ? ORDER BY message_id ASC LIMIT 1 OFFSET ?",
+            (year, count * i // shards),
+        ).fetchone()
+        if row is not None and row[0] != bounds[-1]:
+            bounds.append(row[0])
+    bounds.append(end)
+    return list(zip(bounds, bounds[1:]))
+
+
+def aggregate_shard(task: tuple) -> list[Aggregator]:
+    shard, year, names, id_range = task
+    conn = sqlite3.connect(DB_PATH)
+    aggregators = build_aggregators(names)
+    scan_messages(conn, year, aggregators, id_range, f"Shard {shard}: ")
+    conn.close()
+    return aggregators
+
+
+def aggregate_parallel(
+    conn: sqlite3.Connection,
+    year: int,
+    names: list[str],
+    count: int,
+    workers: int,
+    end: int,
+) -> list[Aggregator]:
+    ranges = get_shard_ranges(conn, year, count, workers, end)
+    tasks = [(shard, year, names, id_range) for shard, id_range in enumerate(ranges)]
+    print(f"Aggregating {len(tasks)} shard(s) with {workers} workers")
+
+    aggregators = None
+    with multiprocessing.Pool(workers) as pool:
+        # imap hands shards back in message order, so each one can be merged
+        # as soon as it arrives
+        for partial in pool.imap(aggregate_shard, tasks):
+            if aggregators is None:
+                aggregators = partial
+                continue
+            for aggregator, other in zip(aggregators, partial):
+                aggregator.merge(other)
+    return aggregators
+
+
+def get_watermark(conn: sqlite3.Connection, year: int, names: list[str]):
+    marks = {
+        name: (max_message_id, message_count)
+        for name, max_message_id, message_count in conn.execute(
+            "SELECT name, max_message_id, message_count FROM aggregate_watermarks WHERE year = ?",
+            (year,),
+        )
+    }
+    if any(name not in marks for name in names):
+        print("No watermark for some aggregators, running a full pass")
+        return None
+    if len({marks[name] for name in names}) != 1:
+        print("Aggregators were last run up to different messages, running a full pass")
+        return None
+
+    max_message_id, message_count = marks[names[0]]
+    current_count = conn.execute(
+        "SELECT COUNT(*) FROM messages WHERE year = ? AND message_id <= ?",
+        (year, max_message_id),
+    ).fetchone()[0]
+    if current_count != message_count:
+        # an older export was added after the last run, only a full pass
+        # picks those messages up
+        print("Messages were added before the watermark, running a full pass")
+        return None
+    return max_message_id
+
+
+def aggregate_delta(
+    conn: sqlite3.Connection, year: int, names: list[str], id_range: tuple
+) -> list[Aggregator]:
+    deltas = build_aggregators(names)
+    scan_messages(conn, year, deltas, id_range)
+    aggregators = build_aggregators(names)
+    for aggregator, delta in zip(aggregators, deltas):
+        aggregator.load(conn, year, delta)
+    for aggregator, delta in zip(aggregators, deltas):
+        aggregator.merge(delta)
+    return aggregators
+
+
+def write_aggregates(
+    conn: sqlite3.Connection,
+    year: int,
+    names: list[str],
+    aggregators: list[Aggregator],
+    replace: bool,
+    watermark: tuple,
+):
+    # every output of the pass and the new watermark go in a single transaction
+    for aggregator in aggregators:
+        aggregator.write(conn, year, replace)
+    conn.executemany(
+        "INSERT OR REPLACE INTO aggregate_watermarks (year, name, max_message_id, message_count, updated_at) VALUES (?, ?, ?, ?, ?)",
+        [(year, name, *watermark, int(time.time())) for name in names],
+    )
+    conn.commit()
+
+
+def main(names: list[str] = AGGREGATORS):
+    print("Current year:", CURRENT_YEAR)
+    conn = sqlite3.connect(DB_PATH)
+    ensure_tables(conn)
+    backfill_derived_columns(conn)
+
+    start_time = time.perf_counter()
+    max_message_id, count = conn.execute(
+        "SELECT COALESCE(MAX(message_id), 0), COUNT(*) FROM messages WHERE year = ?",
+        (CURRENT_YEAR,),
+    ).fetchone()
+    # messages ingested while this runs are left for the next run
+    end = max_message_id + 1
+
+    watermark = get_watermark(conn, CURRENT_YEAR, names) if AGGREGATE_DELTA else None
+    if watermark is not None:
+        new_count = conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE year = ? AND message_id > ? AND message_id < ?",
+            (CURRENT_YEAR, watermark, end),
+        ).fetchone()[0]
+        print(f"Aggregating {new_count} new messages after {watermark}")
+        aggregators = aggregate_delta(conn, CURRENT_YEAR, names, (watermark + 1, end))
+    elif AGGREGATE_WORKERS > 1 and count > 0:
+        new_count = count
+        print(f"Aggregating {count} messages")
+        aggregators = aggregate_parallel(
+            conn, CURRENT_YEAR, names, count, AGGREGATE_WORKERS, end
+        )
+    else:
+        new_count = count
+        print(f"Aggregating {count} messages")
+        aggregators = build_aggregators(names)
+        scan_messages(conn, CURRENT_YEAR, aggregators, (None, end))
+    write_aggregates(
+        conn,
+        CURRENT_YEAR,
+        names,
+        aggregators,
+        watermark is None,
+        (max_message_id, count),
+    )
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"Aggregated {new_count} messages in {elapsed:.1f} second(s) ({new_count / max(elapsed, 1e-9):.0f} rows/sec)"
+    )
+
+    if DOWNLOAD_MEDIA and "users" in names:
+        os.makedirs("avatars", exist_ok=True)
+        asyncio.run(run_downloads(conn))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,28 @@
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 import time
-from typing import Dict, List, Optional
+import traceback
+from typing import Dict, Iterable, List, Optional
 import aiosqlite
 import orjson
-from util import get_avatar_url, process_inline_emojis
+from util import (
+    decode_word_usage,
+    get_attachment_url,
+    get_avatar_url,
+    process_inline_emojis,
+)
 from consts import (
-    ATTACHMENT_URL_BASE,
+    DB_CACHE_MB,
+    DB_MMAP_MB,
+    DB_PATH,
+    DB_READ_POOL_SIZE,
     EMOJI_URL_BASE,
-    EXCLUDED_EXTENSIONS,
-    VIDEO_EXT_LIST,
+    LIKE_FLUSH_MS,
+    LIKE_FLUSH_OPS,
+    LIKE_RETRY_SECONDS,
+    SAMPLING_REFRESH_SECONDS,
+    MENTION_GRAPH_PAGE_SIZE,
 )
 from models import (
     AttachmentInfo,
@@ -28,105 +42,287 @@ from models import (
     WordData,
 )
 from cache import AsyncTTL
+from sampling import SamplingIndex, Shuffle
+
+
+class ReadPool:
+    # read only connections, each running on its own aiosqlite thread, so reads
+    # run in parallel with each other and, with WAL, with the writer
+    def __init__(self):
+        self.connections = []
+        self.idle = asyncio.Queue()
+
+    async def open(self, path: str, size: int):
+        for _ in range(size):
+            connection = await aiosqlite.connect(f"file:{path}?mode=ro", uri=True)
+            await connection.execute("PRAGMA query_only = ON")
+            await connection.execute("PRAGMA busy_timeout = 5000")
+            await connection.execute(f"PRAGMA mmap_size = {DB_MMAP_MB * 2**20}")
+            await connection.execute(f"PRAGMA cache_size = -{DB_CACHE_MB * 1024}")
+            self.connections.append(connection)
+            self.idle.put_nowait(connection)
+
+    @asynccontextmanager
+    async def execute(self, sql: str, parameters=None):
+        # the connection is only held while the cursor is open
+        connection = await self.idle.get()
+        try:
+            async with connection.execute(sql, parameters) as cursor:
+                yield cursor
+        finally:
+            self.idle.put_nowait(connection)
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+        self.connections.clear()
+        self.idle = asyncio.Queue()
+
+
+# columns the backend reads that only process.py's migrations add, see
+# ensure_tables in db.py
+REQUIRED_COLUMNS = {
+    "attachments": ("content_hash",),
+    "messages": ("day_bucket",),
+}
+
+# the same as ensure_like_counts in db.py, the backend creates these too so it
+# can start on a database no ingest has run on since. tests/test_schema.py
+# checks the copies match
+LIKE_COUNTS_TABLE = 'CREATE TABLE IF NOT EXISTS "like_counts" ("is_attachment" INTEGER, "entity_id" INTEGER, "count" INTEGER, PRIMARY KEY ("is_attachment", "entity_id")) WITHOUT ROWID'
+LIKE_COUNT_TRIGGERS = {
+    "likes_count_insert": 'CREATE TRIGGER IF NOT EXISTS "likes_count_insert" AFTER INSERT ON "likes" BEGIN INSERT INTO like_counts VALUES (1, NEW.attachment_id, 1) ON CONFLICT (is_attachment, entity_id) DO UPDATE SET count = count + 1; END',
+    "likes_count_delete": 'CREATE TRIGGER IF NOT EXISTS "likes_count_delete" AFTER DELETE ON "likes" BEGIN UPDATE like_counts SET count = count - 1 WHERE is_attachment = 1 AND entity_id = OLD.attachment_id; DELETE FROM like_counts WHERE is_attachment = 1 AND entity_id = OLD.attachment_id AND count <= 0; END',
+    "message_likes_count_insert": 'CREATE TRIGGER IF NOT EXISTS "message_likes_count_insert" AFTER INSERT ON "message_likes" BEGIN INSERT INTO like_counts VALUES (0, NEW.message_id, 1) ON CONFLICT (is_attachment, entity_id) DO UPDATE SET count = count + 1; END',
+    "message_likes_count_delete": 'CREATE TRIGGER IF NOT EXISTS "message_likes_count_delete" AFTER DELETE ON "message_likes" BEGIN UPDATE like_counts SET count = count - 1 WHERE is_attachment = 0 AND entity_id = OLD.message_id; DELETE FROM like_counts WHERE is_attachment = 0 AND entity_id = OLD.message_id AND count <= 0; END',
+}
+
+# keyed by is_attachment
+LIKE_QUERIES = {
+    True: "INSERT INTO likes VALUES (?, ?, ?) ON CONFLICT (attachment_id, discord_id) DO NOTHING",
+    False: "INSERT INTO message_likes VALUES (?, ?, ?) ON CONFLICT (message_id, discord_id) DO NOTHING",
+}
+UNLIKE_QUERIES = {
+    True: "DELETE FROM likes WHERE attachment_id = ? AND discord_id = ?",
+    False: "DELETE FROM message_likes WHERE message_id = ? AND discord_id = ?",
+}
+# which of a json list of [entity_id, discord_id] pairs are liked
+LIKED_QUERIES = {
+    True: "SELECT attachment_id, discord_id FROM likes WHERE (attachment_id, discord_id) IN (SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))",
+    False: "SELECT message_id, discord_id FROM message_likes WHERE (message_id, discord_id) IN (SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))",
+}
+
+
+class LikeBuffer:
+    # likes and unlikes wait here and the writer commits them in batches, so a
+    # burst of clicks costs one commit instead of one each. a user's latest
+    # click on an item replaces any earlier one still waiting
+    def __init__(self):
+        # (is_attachment, entity_id, discord_id) to (liked, timestamp)
+        self.pending = {}
+        # the batch being written, still overlaid on reads until its commit is
+        # done
+        self.flushing = {}
+        self.commits = 0
+        self.committed = asyncio.Event()
+        self.committed.set()
+        self.lock = asyncio.Lock()
+        self.wake = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    async def run(self):
+        while True:
+            await self.wake.wait()
+            # let a batch gather, unless it's already big enough
+            try:
+                await asyncio.wait_for(self.full.wait(), LIKE_FLUSH_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            self.full.clear()
+            try:
+                # stop() cancelling this doesn't cut a batch off halfway
+                await asyncio.shield(self.flush())
+            except Exception:
+                traceback.print_exc()
+                # the batch is back in pending, try it again after a pause
+                self.wake.set()
+                await asyncio.sleep(LIKE_RETRY_SECONDS)
+
+    def add(self, key: tuple, liked: bool):
+        self.pending[key] = (liked, int(time.time()))
+        self.wake.set()
+        if len(self.pending) >= LIKE_FLUSH_OPS:
+            self.full.set()
+
+    def has_user(self, discord_id: int) -> bool:
+        return any(
+            key[2] == discord_id
+            for entries in (self.flushing, self.pending)
+            for key in entries
+        )
 
-conn = None
+    def get_overlay(self, entity_ids: set, is_attachment: bool) -> Dict[tuple, bool]:
+        # (entity_id, discord_id) to the latest click the database doesn't have
+        # yet, for the given items
+        overlay = {}
+        for entries in (self.flushing, self.pending):
+            for (kind, entity_id, discord_id), (liked, _) in entries.items():
+                if kind == is_attachment and entity_id in entity_ids:
+                    overlay[(entity_id, discord_id)] = liked
+        return overlay
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+            self.flushing, self.pending = self.pending, {}
+            # (is_attachment, liked) to rows for its statement
+            batches = {}
+            for key, (liked, timestamp) in self.flushing.items():
+                is_attachment, entity_id, discord_id = key
+                parameters = (entity_id, discord_id)
+                if liked:
+                    parameters += (timestamp,)
+                batches.setdefault((is_attachment, liked), []).append(parameters)
+            try:
+                for (is_attachment, liked), rows in batches.items():
+                    queries = LIKE_QUERIES if liked else UNLIKE_QUERIES
+                    await writer.executemany(queries[is_attachment], rows)
+                # readers check commits to know whether the database they read
+                # already had this batch
+                self.committed.clear()
+                try:
+                    await writer.commit()
+                finally:
+                    self.commits += 1
+                    self.committed.set()
+            except Exception:
+                await writer.rollback()
+                # back in the queue, under anything clicked since
+                self.pending = {**self.flushing, **self.pending}
+                raise
+            finally:
+                self.flushing = {}
+
+
+read_pool = ReadPool()
+sampling_index = SamplingIndex()
+# the like buffer writes through this single connection
+writer = None
+like_buffer = LikeBuffer()
 
 
 async def init():
-    global conn
-    conn = await aiosqlite.connect("wrapped.db")
+    global writer
+    # the writer opens first and switches the database to WAL, which the read
+    # only connections need to read while it writes
+    writer = await aiosqlite.connect(DB_PATH)
+    await writer.execute("PRAGMA journal_mode = WAL")
+    await writer.execute("PRAGMA synchronous = NORMAL")
+    await writer.execute("PRAGMA busy_timeout = 5000")
+    try:
+        await ensure_schema()
+    except Exception:
+        # the writer's thread would keep the process alive
+        await writer.close()
+        raise
+    await read_pool.open(DB_PATH, DB_READ_POOL_SIZE)
+    await sampling_index.load(read_pool)
+    sampling_index.start(read_pool, SAMPLING_REFRESH_SECONDS)
+    like_buffer.start()
+
+
+async def ensure_schema():
+    # an older database is refused rather than migrated here, apart from the
+    # missing flag and like_counts, which the backend itself keeps up to date
+    columns = {}
+    for table in ("attachments", "messages"):
+        async with writer.execute(f'PRAGMA table_info("{table}")') as cursor:
+            columns[table] = {row[1] for row in await cursor.fetchall()}
+    for table, required in REQUIRED_COLUMNS.items():
+        absent = [column for column in required if column not in columns[table]]
+        if absent:
+            raise RuntimeError(
+                f"{DB_PATH} has no {table}.{', '.join(absent)}, run process.py first"
+            )
+    if "missing" not in columns["attachments"]:
+        await writer.execute(
+            'ALTER TABLE "attachments" ADD COLUMN "missing" INTEGER DEFAULT 0'
+        )
+    # one transaction, so no like lands between the backfill and the triggers
+    await writer.execute("BEGIN IMMEDIATE")
+    async with writer.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'like_counts'"
+    ) as cursor:
+        exists = await cursor.fetchone()
+    await writer.execute(LIKE_COUNTS_TABLE)
+    if not exists:
+        await writer.execute(
+            "INSERT INTO like_counts SELECT 1, attachment_id, COUNT(*) FROM likes GROUP BY attachment_id"
+        )
+        await writer.execute(
+            "INSERT INTO like_counts SELECT 0, message_id, COUNT(*) FROM message_likes GROUP BY message_id"
+        )
+        print("Backfilled like counts")
+    for trigger_sql in LIKE_COUNT_TRIGGERS.values():
+        await writer.execute(trigger_sql)
+    await writer.commit()
 
 
 async def cleanup():
-    if conn and conn.is_alive():
-        await conn.close()
+    global writer
+    # likes still waiting are written before the connections go
+    await like_buffer.stop()
+    await sampling_index.stop()
+    await read_pool.close()
+    if writer is not None:
+        await writer.close()
+        writer = None
 
 
 async def get_random_attachment(
     year: int,
-    excluded_ids: List[str],
+    shuffle: Shuffle,
     video_only: bool = False,
 ) -> AttachmentInfo:
-    where_clause = f"lower(extension) IN ({', '.join(['?' for _ in VIDEO_EXT_LIST])}) AND id NOT IN ({', '.join(['?' for _ in (excluded_ids)])})"
-    default_exclude_clause = f"lower(extension) NOT IN ({', '.join(['?' for _ in EXCLUDED_EXTENSIONS])}) AND id NOT IN ({', '.join(['?' for _ in (excluded_ids)])})"
-    if video_only:
-        cursor = await conn.execute(
-            f"SELECT id, file_name, author_id AS sender_id, author_name AS sender_handle, attachments.timestamp, related_message_id, channel_id, channel_name, content FROM attachments LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE id IN (SELECT id FROM attachments WHERE {where_clause} AND year = ? ORDER BY RANDOM() LIMIT 1)",
-            [*VIDEO_EXT_LIST, *excluded_ids, year],
-        )
-    else:
-        cursor = await conn.execute(
-            f"SELECT id, file_name, author_id AS sender_id, author_name AS sender_handle, attachments.timestamp, related_message_id, channel_id, channel_name, content FROM attachments LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE id IN (SELECT id FROM attachments WHERE {default_exclude_clause} AND year = ? ORDER BY RANDOM() LIMIT 1)",
-            [*EXCLUDED_EXTENSIONS, *excluded_ids, year],
-        )
-
-    row = await cursor.fetchone()
-    if not row:
+    attachment_id = await sampling_index.get_next_attachment_id(
+        read_pool, year, shuffle, video_only
+    )
+    if attachment_id is None:
         return None
 
-    attachment_id = int(row[0])
-    await cursor.close()
-
-    likes = await get_attachment_likes(attachment_id)
-
-    return AttachmentInfo(
-        attachment_id=str(attachment_id),
-        file_name=row[1],
-        url=ATTACHMENT_URL_BASE.format(year, attachment_id, row[1]),
-        sender_id=str(row[2]),
-        sender_handle=row[3],
-        sender_avatar_url=get_avatar_url(year, row[3]),
-        likes=likes,
-        timestamp=row[4],
-        related_message_id=str(row[5]),
-        related_channel_id=str(row[6]),
-        related_channel_name=str(row[7]),
-        related_message_content=row[8],
-    )
+    return await get_attachment(year, attachment_id)
 
 
 async def get_random_message(
     year: int, min_length: int = 1, links_only: bool = False
 ) -> MessageInfo:
-    where_clause = (
-        "AND (content LIKE '%http://%' OR content LIKE '%https://%') "
-        if links_only
-        else ""
+    message_id = await sampling_index.get_random_message_id(
+        read_pool, year, min_length, links_only
     )
-    query = f"""
-SELECT message_id, content, channel_name, author_id, author_name, timestamp, channel_id, inline_emojis
-FROM messages 
-WHERE message_id 
-IN (SELECT message_id FROM messages WHERE content_length >= ? AND year = ? {where_clause}ORDER BY RANDOM() LIMIT 1)
-"""
-    async with conn.execute(
-        query,
-        (min_length, year),
-    ) as cursor:
-        row = await cursor.fetchone()
-
-    if not row:
+    if message_id is None:
         return None
 
-    message_id = int(row[0])
-    likes = await get_message_likes(message_id)
-    inline_emojis = process_inline_emojis(year, orjson.loads(row[7])) if row[7] else {}
-    return MessageInfo(
-        message_id=str(message_id),
-        content=row[1],
-        channel_name=row[2],
-        sender_id=str(row[3]),
-        sender_handle=row[4],
-        sender_avatar_url=get_avatar_url(year, row[4]),
-        timestamp=row[5],
-        likes=likes,
-        channel_id=str(row[6]),
-        emojis=inline_emojis,
-    )
+    return await get_message(year, message_id)
 
 
 async def get_message(year: int, message_id: int) -> MessageInfo:
-    async with conn.execute(
+    async with read_pool.execute(
         "SELECT message_id, content, channel_name, author_id, author_name, timestamp, channel_id, inline_emojis FROM messages WHERE message_id = ? AND year = ?",
         (message_id, year),
     ) as cursor:
@@ -135,7 +331,7 @@ async def get_message(year: int, message_id: int) -> MessageInfo:
     if not row:
         return None
 
-    likes = await get_message_likes(message_id)
+    likes = await get_like_counts([message_id], False)
     inline_emojis = process_inline_emojis(year, orjson.loads(row[7])) if row[7] else {}
 
     return MessageInfo(
@@ -146,15 +342,15 @@ async def get_message(year: int, message_id: int) -> MessageInfo:
         sender_handle=row[4],
         sender_avatar_url=get_avatar_url(year, row[4]),
         timestamp=row[5],
-        likes=likes,
+        likes=likes.get(message_id, 0),
         channel_id=str(row[6]),
         emojis=inline_emojis,
     )
 
 
 async def get_attachment(year: int, attachment_id: int) -> Optional[AttachmentInfo]:
-    async with conn.execute(
-        "SELECT id, file_name, author_id AS sender_id, author_name AS sender_handle, attachments.timestamp, related_message_id, channel_id, channel_name, content FROM attachments LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE id = ? AND attachments.year = ?",
+    async with read_pool.execute(
+        "SELECT id, file_name, author_id AS sender_id, author_name AS sender_handle, attachments.timestamp, related_message_id, channel_id, channel_name, content, attachments.content_hash FROM attachments LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE id = ? AND attachments.year = ? AND attachments.missing = 0",
         (attachment_id, year),
     ) as cursor:
         row = await cursor.fetchone()
@@ -162,15 +358,15 @@ async def get_attachment(year: int, attachment_id: int) -> Optional[AttachmentIn
     if not row:
         return None
 
-    likes = await get_attachment_likes(attachment_id)
+    likes = await get_like_counts([attachment_id], True)
     return AttachmentInfo(
         attachment_id=str(row[0]),
         file_name=row[1],
-        url=ATTACHMENT_URL_BASE.format(year, attachment_id, row[1]),
+        url=get_attachment_url(year, attachment_id, row[1], row[9]),
         sender_id=str(row[2]),
         sender_handle=row[3],
         sender_avatar_url=get_avatar_url(year, row[3]),
-        likes=likes,
+        likes=likes.get(attachment_id, 0),
         timestamp=row[4],
         related_message_id=str(row[5]),
         related_channel_id=str(row[6]),
@@ -180,27 +376,34 @@ async def get_attachment(year: int, attachment_id: int) -> Optional[AttachmentIn
 
 
 async def get_likes_for_user(year: int, discord_id: str) -> Dict[str, List[str]]:
-    async with conn.execute(
-        f"SELECT attachment_id, file_name, messages.author_name, messages.content, messages.channel_name FROM likes LEFT JOIN attachments ON likes.attachment_id = attachments.id LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE discord_id = {int(discord_id)} AND attachments.year = ? ORDER BY likes.timestamp DESC",
+    # the user's own clicks still in the buffer are written first
+    if like_buffer.has_user(int(discord_id)):
+        await like_buffer.flush()
+    async with read_pool.execute(
+        f"SELECT attachment_id, file_name, messages.author_name, messages.content, messages.channel_name, attachments.content_hash FROM likes LEFT JOIN attachments ON likes.attachment_id = attachments.id LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE discord_id = {int(discord_id)} AND attachments.year = ? AND attachments.missing = 0 ORDER BY likes.timestamp DESC",
         (year,),
     ) as cursor:
         attachment_rows = await cursor.fetchall()
 
-    async with conn.execute(
+    async with read_pool.execute(
         f"SELECT messages.message_id, messages.content, messages.author_name, messages.channel_name FROM message_likes LEFT JOIN messages ON message_likes.message_id = messages.message_id WHERE discord_id = {int(discord_id)} AND messages.year = ? ORDER BY message_likes.timestamp DESC",
         (year,),
     ) as cursor:
         message_rows = await cursor.fetchall()
+
+    attachment_likes = await get_like_counts([row[0] for row in attachment_rows], True)
+    message_likes = await get_like_counts([row[0] for row in message_rows], False)
     return {
         "attachments": [
             AttachmentSummary(
                 attachment_id=str(row[0]),
                 file_name=row[1],
-                url=ATTACHMENT_URL_BASE.format(year, row[0], row[1]),
+                url=get_attachment_url(year, row[0], row[1], row[5]),
                 sender_handle=row[2],
                 sender_avatar_url=get_avatar_url(year, row[2]),
                 related_message_content=row[3],
                 related_channel_name=row[4],
+                likes=attachment_likes.get(row[0], 0),
             )
             for row in attachment_rows
         ],
@@ -211,47 +414,56 @@ async def get_likes_for_user(year: int, discord_id: str) -> Dict[str, List[str]]
                 sender_handle=row[2],
                 sender_avatar_url=get_avatar_url(year, row[2]),
                 channel_name=row[3],
+                likes=message_likes.get(row[0], 0),
             )
             for row in message_rows
         ],
     }
 
 
-async def get_attachment_likes(attachment_id: int) -> int:
-    async with conn.execute(
-        f"SELECT COUNT(attachment_id) FROM likes WHERE attachment_id = {attachment_id}"
-    ) as cursor:
-        like_row = await cursor.fetchone()
-        if like_row:
-            return like_row[0]
-        return 0
-
-
-async def get_message_likes(message_id: int) -> int:
-    async with conn.execute(
-        f"SELECT COUNT(message_id) FROM message_likes WHERE message_id = {message_id}"
-    ) as cursor:
-        like_row = await cursor.fetchone()
-        if like_row:
-            return like_row[0]
-        return 0
+async def get_like_counts(
+    entity_ids: Iterable[int], is_attachment: bool
+) -> Dict[int, int]:
+    # likes of a whole page of items in one lookup on the like_counts primary
+    # key, corrected for clicks on them still in the buffer. items without
+    # likes are left out
+    entity_ids = set(entity_ids)
+    if not entity_ids:
+        return {}
+    while True:
+        # a batch committing while this reads would be counted twice or not
+        # at all, so that read is done again
+        await like_buffer.committed.wait()
+        commits = like_buffer.commits
+        overlay = like_buffer.get_overlay(entity_ids, is_attachment)
+        async with read_pool.execute(
+            "SELECT entity_id, count FROM like_counts WHERE is_attachment = ? AND entity_id IN (SELECT value FROM json_each(?))",
+            (int(is_attachment), orjson.dumps(list(entity_ids)).decode()),
+        ) as cursor:
+            counts = dict(await cursor.fetchall())
+        liked = set()
+        if overlay:
+            async with read_pool.execute(
+                LIKED_QUERIES[is_attachment], (orjson.dumps(list(overlay)).decode(),)
+            ) as cursor:
+                liked = set(await cursor.fetchall())
+        if like_buffer.committed.is_set() and commits == like_buffer.commits:
+            break
+    # the counts as of when the buffer was looked at, clicks made while reading
+    # are left for the next read
+    for key, is_liked in overlay.items():
+        if is_liked != (key in liked):
+            entity_id = key[0]
+            counts[entity_id] = counts.get(entity_id, 0) + (1 if is_liked else -1)
+    return counts
 
 
 async def like(entity_id: int, discord_id: int, is_attachment: bool):
-    timestamp = int(time.time())
-    query = "INSERT INTO message_likes VALUES (?, ?, ?) ON CONFLICT (message_id, discord_id) DO NOTHING"
-    if is_attachment:
-        query = "INSERT INTO likes VALUES (?, ?, ?) ON CONFLICT (attachment_id, discord_id) DO NOTHING"
-    await conn.execute(query, (entity_id, discord_id, timestamp))
-    await conn.commit()
+    like_buffer.add((is_attachment, entity_id, discord_id), True)
 
 
 async def unlike(entity_id: int, discord_id: int, is_attachment: bool):
-    query = "DELETE FROM message_likes WHERE message_id = ? AND discord_id = ?"
-    if is_attachment:
-        query = "DELETE FROM likes WHERE attachment_id = ? AND discord_id = ?"
-    await conn.execute(query, (entity_id, discord_id))
-    await conn.commit()
+    like_buffer.add((is_attachment, entity_id, discord_id), False)
 
 
 @AsyncTTL(time_to_live=60, maxsize=None)
@@ -267,19 +479,20 @@ SELECT
     messages.author_name AS sender_handle,
     content,
     channel_name,
-    like_count
+    like_count,
+    attachments.content_hash
 FROM
     (
         SELECT
-            attachment_id,
-            COUNT(attachment_id) as like_count
+            entity_id AS attachment_id,
+            count AS like_count
         FROM
-            likes
-        GROUP BY
-            attachment_id
+            like_counts
+        WHERE
+            is_attachment = 1
     ) al
     LEFT JOIN attachments ON attachments.id = al.attachment_id
-    LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE attachments.year = ?;
+    LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE attachments.year = ? AND attachments.missing = 0;
 """
 
     message_query = """
@@ -296,17 +509,17 @@ SELECT
 FROM
     (
         SELECT
-            message_id,
-            COUNT(message_id) as like_count
+            entity_id AS message_id,
+            count AS like_count
         FROM
-            message_likes
-        GROUP BY
-            message_id
+            like_counts
+        WHERE
+            is_attachment = 0
     ) ml
     LEFT JOIN messages ON messages.message_id = ml.message_id WHERE messages.year = ?;
 """
 
-    async with conn.execute(attachment_query, (year,)) as cursor:
+    async with read_pool.execute(attachment_query, (year,)) as cursor:
         attachment_rows = await cursor.fetchall()
 
     if not attachment_rows:
@@ -314,7 +527,7 @@ FROM
 
     attachment_rows.sort(key=lambda row: row[0])
 
-    async with conn.execute(message_query, (year,)) as cursor:
+    async with read_pool.execute(message_query, (year,)) as cursor:
         message_rows = await cursor.fetchall()
 
     if not message_rows:
@@ -327,7 +540,7 @@ FROM
             AttachmentSummary(
                 attachment_id=str(row[1]),
                 file_name=row[2],
-                url=ATTACHMENT_URL_BASE.format(year, row[1], row[2]),
+                url=get_attachment_url(year, row[1], row[2], row[7]),
                 sender_handle=row[3],
                 sender_avatar_url=get_avatar_url(year, row[3]),
                 related_message_content=row[4],
@@ -375,7 +588,7 @@ FROM
 WHERE
     user_id = ? AND year = ?;
 """
-    async with conn.execute(
+    async with read_pool.execute(
         query,
         (discord_id, year),
     ) as cursor:
@@ -439,7 +652,7 @@ FROM
     users
 WHERE year = ?;
 """
-    async with conn.execute(
+    async with read_pool.execute(
         query,
         (year,),
     ) as cursor:
@@ -470,16 +683,16 @@ async def get_notable_content(
     year: int, discord_id: int, n: int = 20
 ) -> List[NotableAttachmentSummary | NotableMessageSummary]:
     query = """
-SELECT messages.message_id, messages.content, messages.channel_name, messages.author_name, messages.total_reactions, attachments.id, attachments.file_name 
+SELECT messages.message_id, messages.content, messages.channel_name, messages.author_name, messages.total_reactions, attachments.id, attachments.file_name, attachments.content_hash
 FROM messages 
 LEFT JOIN attachments 
-ON messages.message_id = attachments.related_message_id 
+ON messages.message_id = attachments.related_message_id AND attachments.missing = 0
 WHERE messages.year = ? 
 AND messages.author_id = ? 
 ORDER BY messages.total_reactions DESC 
 LIMIT ?;
 """
-    async with conn.execute(
+    async with read_pool.execute(
         query,
         (year, discord_id, n),
     ) as cursor:
@@ -494,6 +707,7 @@ LIMIT ?;
                 total_reactions,
                 attachment_id,
                 file_name,
+                content_hash,
             ) = row
             if not attachment_id:
                 results.append(
@@ -511,7 +725,9 @@ LIMIT ?;
                     NotableAttachmentSummary(
                         attachment_id=str(attachment_id),
                         file_name=file_name,
-                        url=ATTACHMENT_URL_BASE.format(year, attachment_id, file_name),
+                        url=get_attachment_url(
+                            year, attachment_id, file_name, content_hash
+                        ),
                         sender_handle=author_name,
                         sender_avatar_url=get_avatar_url(year, author_name),
                         related_message_content=content,
@@ -526,95 +742,152 @@ LIMIT ?;
 async def get_time_machine_screenshot(date: datetime, year: int):
     MAX_MESSAGE_COUNT = 5
     MAX_ATTACHMENT_COUNT = 3
-    start_time = int(date.replace(tzinfo=timezone.utc).timestamp())
-    end_time = start_time + 86400
-    async with conn.execute(
-        "SELECT id, file_name, author_id AS sender_id, author_name AS sender_handle, attachments.timestamp, related_message_id, channel_id, channel_name, content FROM attachments LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE messages.timestamp >= ? AND messages.timestamp <= ? AND attachments.year = ? ORDER BY RANDOM() LIMIT ?",
-        (start_time, end_time, year, MAX_ATTACHMENT_COUNT),
+    day_bucket = int(date.replace(tzinfo=timezone.utc).timestamp())
+    async with read_pool.execute(
+        "SELECT id, file_name, author_id AS sender_id, author_name AS sender_handle, attachments.timestamp, related_message_id, channel_id, channel_name, content, attachments.content_hash FROM attachments LEFT JOIN messages ON attachments.related_message_id = messages.message_id WHERE messages.day_bucket = ? AND messages.year = ? AND attachments.year = ? AND attachments.missing = 0 ORDER BY RANDOM() LIMIT ?",
+        (day_bucket, year, year, MAX_ATTACHMENT_COUNT),
     ) as cursor:
         rows = await cursor.fetchall()
-        attachments = [
-            AttachmentInfo(
-                attachment_id=str(row[0]),
-                file_name=row[1],
-                url=ATTACHMENT_URL_BASE.format(year, row[0], row[1]),
-                sender_id=str(row[2]),
-                sender_handle=row[3],
-                sender_avatar_url=get_avatar_url(year, row[3]),
-                likes=0,
-                timestamp=row[4],
-                related_message_id=str(row[5]),
-                related_channel_id=str(row[6]),
-                related_channel_name=str(row[7]),
-                related_message_content=row[8],
-            )
-            for row in rows
-        ]
 
-    async with conn.execute(
-        "SELECT message_id, content, channel_name, author_id, author_name, timestamp, channel_id, inline_emojis FROM messages WHERE content_length > 0 AND timestamp >= ? AND timestamp <= ? AND year = ? ORDER BY RANDOM() LIMIT ?",
-        (start_time, end_time, year, MAX_MESSAGE_COUNT),
+    likes = await get_like_counts([row[0] for row in rows], True)
+    attachments = [
+        AttachmentInfo(
+            attachment_id=str(row[0]),
+            file_name=row[1],
+            url=get_attachment_url(year, row[0], row[1], row[9]),
+            sender_id=str(row[2]),
+            sender_handle=row[3],
+            sender_avatar_url=get_avatar_url(year, row[3]),
+            likes=likes.get(row[0], 0),
+            timestamp=row[4],
+            related_message_id=str(row[5]),
+            related_channel_id=str(row[6]),
+            related_channel_name=str(row[7]),
+            related_message_content=row[8],
+        )
+        for row in rows
+    ]
+
+    async with read_pool.execute(
+        "SELECT message_id, content, channel_name, author_id, author_name, timestamp, channel_id, inline_emojis FROM messages WHERE year = ? AND day_bucket = ? AND content_length > 0 ORDER BY RANDOM() LIMIT ?",
+        (year, day_bucket, MAX_MESSAGE_COUNT),
     ) as cursor:
         rows = await cursor.fetchall()
 
-        messages = []
-        for row in rows:
-            inline_emojis = (
-                process_inline_emojis(year, orjson.loads(row[7])) if row[7] else {}
-            )
-            messages.append(
-                MessageInfo(
-                    message_id=str(row[0]),
-                    content=row[1],
-                    channel_name=row[2],
-                    sender_id=str(row[3]),
-                    sender_handle=row[4],
-                    sender_avatar_url=get_avatar_url(year, row[4]),
-                    timestamp=row[5],
-                    likes=0,
-                    channel_id=str(row[6]),
-                    emojis=inline_emojis,
-                )
+    likes = await get_like_counts([row[0] for row in rows], False)
+    messages = []
+    for row in rows:
+        inline_emojis = (
+            process_inline_emojis(year, orjson.loads(row[7])) if row[7] else {}
+        )
+        messages.append(
+            MessageInfo(
+                message_id=str(row[0]),
+                content=row[1],
+                channel_name=row[2],
+                sender_id=str(row[3]),
+                sender_handle=row[4],
+                sender_avatar_url=get_avatar_url(year, row[4]),
+                timestamp=row[5],
+                likes=likes.get(row[0], 0),
+                channel_id=str(row[6]),
+                emojis=inline_emojis,
             )
+        )
 
     return TimeMachineScreenshot(attachments=attachments, messages=messages)
 
 
 @AsyncTTL(time_to_live=3600, maxsize=None)
-async def get_mention_graph(year: int):
-    async with conn.execute(
-        "SELECT user_name, most_mentioned_given_name, most_mentioned_given_count FROM users WHERE year = ? AND most_mentioned_given_count > 0",
-        (year,),
-    ) as cursor:
+async def get_mention_graph(
+    year: int,
+    min_count: int = 1,
+    top_k: Optional[int] = None,
+    user_id: Optional[int] = None,
+    limit: Optional[int] = MENTION_GRAPH_PAGE_SIZE,
+    offset: int = 0,
+):
+    edge_query = "SELECT * FROM mention_edges WHERE year = ? AND count >= ?"
+    params = [year, min_count]
+    if user_id is not None:
+        # ego graph, every edge out of and into the user. two queries instead
+        # of an OR so each side can use its own index
+        edge_query = f"{edge_query} AND from_user_id = ? UNION ALL {edge_query} AND to_user_id = ? AND from_user_id != ?"
+        params = [year, min_count, user_id, year, min_count, user_id, user_id]
+
+    if top_k is None:
+        query = f"SELECT from_user_id, to_user_id, from_name, to_name, count FROM ({edge_query}) ORDER BY count DESC, from_user_id ASC, to_user_id ASC LIMIT ? OFFSET ?"
+    else:
+        # ties go to whoever was mentioned first, the same as most_mentioned
+        query = f"""
+SELECT
+    from_user_id,
+    to_user_id,
+    from_name,
+    to_name,
+    count
+FROM
+    (
+        SELECT
+            *,
+            ROW_NUMBER() OVER (
+                PARTITION BY from_user_id
+                ORDER BY
+                    count DESC,
+                    first_message_id ASC,
+                    first_position ASC
+            ) AS rank
+        FROM
+            ({edge_query})
+    )
+WHERE
+    rank <= ?
+ORDER BY
+    count DESC,
+    from_user_id ASC,
+    to_user_id ASC
+LIMIT
+    ? OFFSET ?
+"""
+        params.append(top_k)
+
+    # one extra row tells us whether there is another page, no limit is -1
+    page_rows = -1 if limit is None else limit + 1
+    async with read_pool.execute(query, [*params, page_rows, offset]) as cursor:
         rows = await cursor.fetchall()
-        edges = []
-        for row in rows:
-            username, mentioned_name, count = row
-            edge = MentionGraphEdge(
-                from_user=username,
-                from_user_avatar_url=get_avatar_url(year, username),
-                to_user=mentioned_name,
-                to_user_avatar_url=get_avatar_url(year, mentioned_name),
-                count=count,
-            )
-            edges.append(edge)
 
-    return MentionGraphResponse(edges=edges)
+    edges = []
+    for from_user_id, to_user_id, from_name, to_name, count in rows[:limit]:
+        edge = MentionGraphEdge(
+            from_user_id=str(from_user_id),
+            from_user=from_name,
+            from_user_avatar_url=get_avatar_url(year, from_name),
+            to_user_id=str(to_user_id),
+            to_user=to_name,
+            to_user_avatar_url=get_avatar_url(year, to_name),
+            count=count,
+        )
+        edges.append(edge)
+
+    next_offset = None
+    if limit is not None and len(rows) > limit:
+        next_offset = offset + limit
+    return MentionGraphResponse(edges=edges, next_offset=next_offset)
 
 
 @AsyncTTL(time_to_live=3600, maxsize=None)
 async def get_word_data(year: int, word: str) -> Optional[WordData]:
-    async with conn.execute(
+    async with read_pool.execute(
         "SELECT data FROM word_usage WHERE word = ? AND year = ?", (word, year)
     ) as cursor:
         row = await cursor.fetchone()
         if not row:
             return None
-        word_data = orjson.loads(row[0])
-        total_count = word_data["total"]
+        total_count, days = decode_word_usage(row[0])
+        # the decoded values are already ints, skip validating every day
         buckets = [
-            TimestampBucket(timestamp=int(bucket), count=word_data["buckets"][bucket])
-            for bucket in word_data["buckets"]
+            TimestampBucket.model_construct(timestamp=timestamp, count=count)
+            for timestamp, count in days
         ]
 
     return WordData(total_count=total_count, buckets=buckets)
@@ -622,7 +895,7 @@ async def get_word_data(year: int, word: str) -> Optional[WordData]:
 
 @AsyncTTL(time_to_live=86400, maxsize=None)
 async def get_static_buckets(year: int) -> StaticBuckets:
-    async with conn.execute(
+    async with read_pool.execute(
         "SELECT key, value FROM static WHERE year = ?", (year,)
     ) as cursor:
         message_buckets, reaction_buckets, mention_buckets = [], [], []
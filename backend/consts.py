@@ -8,6 +8,8 @@ REDIRECT_URI = (
     else "http://localhost:3000/"
 )
 CLIENT_SECRET = ""
+# media_type of ingested attachments is derived from these, keep derived.py in
+# sync when changing them
 VIDEO_EXT_LIST = [
     ".webm",
     ".mkv",
@@ -53,11 +55,32 @@ EXCLUDED_EXTENSIONS = [".yaml", ".zip"]
 ATTACHMENT_URL_BASE = (
     "https://redside.tor1.digitaloceanspaces.com/sw/{}/attachments/{}_{}"
 )
+# content-addressed attachments, <sha256><lowercase extension>
+ATTACHMENT_BLOB_URL_BASE = (
+    "https://redside.tor1.digitaloceanspaces.com/sw/{}/attachments/{}{}"
+)
 AVATAR_URL_BASE = "https://redside.tor1.digitaloceanspaces.com/sw/{}/avatars/{}.png"
 # png or gif
 EMOJI_URL_BASE = "https://redside.tor1.digitaloceanspaces.com/sw/{}/emojis/{}"
 
-ATTACHMENT_EXCLUDE_REPEAT_COUNT = 25
+MENTION_GRAPH_PAGE_SIZE = 500
+MENTION_GRAPH_MAX_PAGE_SIZE = 5000
+
+DB_PATH = "wrapped.db"
+# read only connections serving requests, and the mmap and page cache each of
+# them gets
+DB_READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", "4"))
+DB_MMAP_MB = int(os.environ.get("DB_MMAP_MB", "256"))
+DB_CACHE_MB = int(os.environ.get("DB_CACHE_MB", "32"))
+# likes and unlikes are committed in batches, at most this long after the
+# first one of a batch or as soon as this many are waiting
+LIKE_FLUSH_MS = int(os.environ.get("LIKE_FLUSH_MS", "5"))
+LIKE_FLUSH_OPS = int(os.environ.get("LIKE_FLUSH_OPS", "256"))
+# how often to check whether ingest changed the database, and rebuild the
+# random pick indexes if it did
+SAMPLING_REFRESH_SECONDS = int(os.environ.get("SAMPLING_REFRESH_SECONDS", "60"))
+# pause before writing a batch again after its commit failed
+LIKE_RETRY_SECONDS = 1
 
 with open("client_secret", "r") as f:
     CLIENT_SECRET = f.read()
@@ -7,7 +7,7 @@ from fastapi import FastAPI, HTTPException, Header, Path
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import async_db
-from consts import ATTACHMENT_EXCLUDE_REPEAT_COUNT
+from consts import MENTION_GRAPH_MAX_PAGE_SIZE, MENTION_GRAPH_PAGE_SIZE
 from util import (
     check_token,
     exchange_code,
@@ -20,9 +20,12 @@ from util import (
 from models import *
 import traceback
 from cachetools import TTLCache
+from sampling import Shuffle
 
 token_cache: TTLCache[str, int] = TTLCache(ttl=86400 * 7, maxsize=float("inf"))
-attachment_session_cache: TTLCache[str, List[str]] = TTLCache(
+# (token, year, video_only) to where that session is in its shuffled order of
+# the attachments
+attachment_session_cache: TTLCache[tuple, Shuffle] = TTLCache(
     ttl=3600, maxsize=float("inf")
 )
 session = None
@@ -146,20 +149,17 @@ async def get_random_attachment(
     year: int = CURRENT_YEAR,
 ):
     check_token(token_cache, token)
-    if token not in attachment_session_cache:
-        attachment_session_cache[token] = []
+    session_key = (token, year, video_only)
+    if session_key not in attachment_session_cache:
+        attachment_session_cache[session_key] = Shuffle()
 
     attachment = await async_db.get_random_attachment(
-        year, attachment_session_cache[token], video_only
+        year, attachment_session_cache[session_key], video_only
     )
 
     if not attachment:
         raise HTTPException(status_code=404, detail="No attachments found.")
 
-    attachment_session_cache[token].append(attachment.attachment_id)
-    if len(attachment_session_cache[token]) > ATTACHMENT_EXCLUDE_REPEAT_COUNT:
-        attachment_session_cache[token].pop(0)
-
     return attachment
 
 
@@ -229,7 +229,9 @@ async def like(
 ):
     check_token(token_cache, token)
     discord_id = get_user_from_token(token_cache, token)
-    await async_db.like(request.id, discord_id, request.is_attachment)
+    if not request.id.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid id.")
+    await async_db.like(int(request.id), int(discord_id), request.is_attachment)
     return {"message": "Success"}
 
 
@@ -239,7 +241,9 @@ async def like(
 ):
     check_token(token_cache, token)
     discord_id = get_user_from_token(token_cache, token)
-    await async_db.unlike(request.id, discord_id, request.is_attachment)
+    if not request.id.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid id.")
+    await async_db.unlike(int(request.id), int(discord_id), request.is_attachment)
     return {"message": "Success"}
 
 
@@ -297,9 +301,38 @@ if __name__ == "__main__":
 async def mention_graph(
     token: Annotated[str | None, Header()] = None,
     year: int = CURRENT_YEAR,
+    min_count: int = 1,
+    top_k: int | None = None,
+    user_id: int | None = None,
+    limit: int | None = None,
+    offset: int = 0,
 ):
     check_token(token_cache, token)
-    return await async_db.get_mention_graph(year)
+    if min_count < 1:
+        raise HTTPException(status_code=400, detail="min_count must be at least 1.")
+
+    if top_k is not None and top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1.")
+
+    if top_k is None and user_id is None and limit is None and offset == 0:
+        # what the graph has always shown: every user's most mentioned, in one
+        # response
+        top_k = 1
+    elif limit is None:
+        limit = MENTION_GRAPH_PAGE_SIZE
+
+    if limit is not None and (limit < 1 or limit > MENTION_GRAPH_MAX_PAGE_SIZE):
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be 1 to {MENTION_GRAPH_MAX_PAGE_SIZE}.",
+        )
+
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="offset can't be negative.")
+
+    return await async_db.get_mention_graph(
+        year, min_count, top_k, user_id, limit, offset
+    )
 
 
 @app.get("/charts")
@@ -151,8 +151,10 @@ class TimeMachineScreenshot(BaseModel):
 
 
 class MentionGraphEdge(BaseModel):
+    from_user_id: str
     from_user: str
     from_user_avatar_url: str
+    to_user_id: str
     to_user: str
     to_user_avatar_url: str
     count: int
@@ -160,6 +162,7 @@ class MentionGraphEdge(BaseModel):
 
 class MentionGraphResponse(BaseModel):
     edges: List[MentionGraphEdge]
+    next_offset: Optional[int] = None
 
 
 class TimestampBucket(BaseModel):
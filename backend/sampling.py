@@ -0,0 +1,219 @@
+import asyncio
+from array import array
+from bisect import bisect_left
+import random
+import traceback
+from typing import AsyncIterator, List, Optional, Tuple
+
+FETCH_ROWS = 100000
+# what changes when ingest or the downloader changes the candidates: new rows
+# get higher rowids, and re-ingested files and finished or failed downloads
+# change rows in place
+STAMP_SOURCES = {
+    "messages": "MAX(rowid)",
+    "attachments": "MAX(rowid)",
+    "ingest_manifest": "MAX(updated_at)",
+    "downloads": "MAX(updated_at)",
+}
+FEISTEL_ROUNDS = 4
+MASK_64 = 2**64 - 1
+
+
+class YearIndex:
+    # candidate ids of one year, built once so a random pick doesn't have to
+    # sort the year with ORDER BY RANDOM()
+    __slots__ = ("attachment_ids", "message_lengths", "message_ids")
+
+    def __init__(self):
+        # media_type to attachment ids
+        self.attachment_ids = {"video": array("q"), "image": array("q")}
+        # has_link to message ids sorted by content_length, and their lengths
+        self.message_lengths = {0: array("i"), 1: array("i")}
+        self.message_ids = {0: array("q"), 1: array("q")}
+
+
+def choose(groups: List[Tuple[array, int]]) -> Optional[int]:
+    # uniform over ids[start:] of every group
+    total = sum(len(ids) - start for ids, start in groups)
+    if total <= 0:
+        return None
+    position = random.randrange(total)
+    for ids, start in groups:
+        size = len(ids) - start
+        if position < size:
+            return ids[start + position]
+        position -= size
+
+
+def mix(value: int, key: int) -> int:
+    # splitmix64 finalizer
+    value = (value ^ key) * 0x9E3779B97F4A7C15 & MASK_64
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & MASK_64
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & MASK_64
+    return value ^ (value >> 31)
+
+
+class Shuffle:
+    # a session's walk through a seeded permutation of range(size), so it sees
+    # every candidate once before any of them comes back, while only storing a
+    # seed, a cursor and the size the permutation is over
+    __slots__ = ("seed", "cursor", "size")
+
+    def __init__(self):
+        self.seed = random.getrandbits(64)
+        self.cursor = 0
+        self.size = None
+
+    def permute(self, position: int, size: int) -> int:
+        # a feistel network is a bijection on the smallest even power of two
+        # holding size; values past size are walked through it again until
+        # they land inside, which keeps it a bijection on range(size)
+        half = max(1, ((size - 1).bit_length() + 1) // 2)
+        mask = (1 << half) - 1
+        keys = [mix(self.seed, step) for step in range(FEISTEL_ROUNDS)]
+        while True:
+            left, right = position >> half, position & mask
+            for key in keys:
+                left, right = right, left ^ (mix(right, key) & mask)
+            position = (left << half) | right
+            if position < size:
+                return position
+
+    def next(self, size: int) -> int:
+        # start over in a new order once every candidate was seen, or when a
+        # refresh of the index changed size, which the walk so far was not over
+        if self.cursor >= size or size != self.size:
+            self.seed = random.getrandbits(64)
+            self.cursor = 0
+            self.size = size
+        position = self.permute(self.cursor, size)
+        self.cursor += 1
+        return position
+
+
+class SamplingIndex:
+    def __init__(self):
+        self.years = {}
+        self.lock = asyncio.Lock()
+        self.stamp = None
+        self.task = None
+
+    async def fetch(self, pool, query: str, parameters: tuple) -> AsyncIterator[tuple]:
+        async with pool.execute(query, parameters) as cursor:
+            while rows := await cursor.fetchmany(FETCH_ROWS):
+                for row in rows:
+                    yield row
+
+    async def build(self, pool, year: int) -> YearIndex:
+        index = YearIndex()
+        for media_type, ids in index.attachment_ids.items():
+            async for (attachment_id,) in self.fetch(
+                pool,
+                "SELECT id FROM attachments WHERE year = ? AND media_type = ? AND missing = 0",
+                (year, media_type),
+            ):
+                ids.append(attachment_id)
+        # walks idx_messages_year_has_link_content_length, already sorted
+        for has_link in (0, 1):
+            lengths = index.message_lengths[has_link]
+            ids = index.message_ids[has_link]
+            async for content_length, message_id in self.fetch(
+                pool,
+                "SELECT content_length, message_id FROM messages WHERE year = ? AND has_link = ? ORDER BY content_length ASC",
+                (year, has_link),
+            ):
+                lengths.append(content_length)
+                ids.append(message_id)
+        return index
+
+    async def get(self, pool, year: int) -> YearIndex:
+        index = self.years.get(year)
+        if index is None:
+            async with self.lock:
+                index = self.years.get(year)
+                if index is None:
+                    index = self.years[year] = await self.build(pool, year)
+        return index
+
+    async def get_years(self, pool) -> List[int]:
+        async with pool.execute(
+            "SELECT DISTINCT year FROM messages WHERE year IS NOT NULL"
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def get_stamp(self, pool) -> tuple:
+        async with pool.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ) as cursor:
+            tables = {row[0] for row in await cursor.fetchall()}
+        sources = [
+            f"(SELECT {expression} FROM {table})"
+            for table, expression in STAMP_SOURCES.items()
+            if table in tables
+        ]
+        async with pool.execute(f"SELECT {', '.join(sources)}") as cursor:
+            return tuple(await cursor.fetchone())
+
+    async def load(self, pool):
+        self.stamp = await self.get_stamp(pool)
+        for year in await self.get_years(pool):
+            await self.get(pool, year)
+
+    async def refresh(self, pool):
+        # the stamp is read first, so anything changed during the build is
+        # picked up by the next refresh
+        stamp = await self.get_stamp(pool)
+        if stamp == self.stamp:
+            return
+        print("Database changed, rebuilding sampling index")
+        years = {}
+        for year in await self.get_years(pool):
+            years[year] = await self.build(pool, year)
+        # picks keep using the old index until the new one is complete
+        self.years = years
+        self.stamp = stamp
+
+    async def run(self, pool, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(pool)
+            except Exception:
+                traceback.print_exc()
+
+    def start(self, pool, interval: float):
+        self.task = asyncio.create_task(self.run(pool, interval))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def get_next_attachment_id(
+        self, pool, year: int, shuffle: Shuffle, video_only: bool
+    ) -> Optional[int]:
+        index = await self.get(pool, year)
+        media_types = ("video",) if video_only else ("video", "image")
+        groups = [index.attachment_ids[media_type] for media_type in media_types]
+        size = sum(len(ids) for ids in groups)
+        if size == 0:
+            return None
+        position = shuffle.next(size)
+        for ids in groups:
+            if position < len(ids):
+                return ids[position]
+            position -= len(ids)
+
+    async def get_random_message_id(
+        self, pool, year: int, min_length: int, links_only: bool
+    ) -> Optional[int]:
+        index = await self.get(pool, year)
+        groups = []
+        for has_link in (1,) if links_only else (0, 1):
+            start = bisect_left(index.message_lengths[has_link], min_length)
+            groups.append((index.message_ids[has_link], start))
+        return choose(groups)
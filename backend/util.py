@@ -1,9 +1,13 @@
 import os
-from typing import Dict, List
+import pathlib
+from typing import Dict, List, Optional
 import aiohttp
 from fastapi import HTTPException
 from models import MessageInlineEmoji
+from word_usage import decode_word_usage
 from consts import (
+    ATTACHMENT_BLOB_URL_BASE,
+    ATTACHMENT_URL_BASE,
     AVATAR_URL_BASE,
     CLIENT_ID,
     CLIENT_SECRET,
@@ -107,6 +111,16 @@ def get_avatar_url(year: int, username: str) -> str:
     return get_default_discord_avatar_url(username)
 
 
+def get_attachment_url(
+    year: int, attachment_id: int, file_name: str, content_hash: Optional[str]
+) -> str:
+    if content_hash:
+        extension = pathlib.Path(f"{attachment_id}_{file_name}").suffix.lower()
+        return ATTACHMENT_BLOB_URL_BASE.format(year, content_hash, extension)
+
+    return ATTACHMENT_URL_BASE.format(year, attachment_id, file_name)
+
+
 def get_default_discord_avatar_url(username: str) -> str:
     default_avatar_num = int.from_bytes(username.encode()) % 5
     return f"https://cdn.discordapp.com/embed/avatars/{default_avatar_num}.png"
@@ -0,0 +1,31 @@
+import struct
+from typing import List, Tuple
+
+import orjson
+
+# same layout as word_codec.py in the processing scripts, kept free of the
+# backend's other imports so tests can load both decoders side by side
+WORD_USAGE_HEADER = struct.Struct("<BBIII")
+DAY_SECONDS = 86400
+COUNT_FORMATS = {2: "H", 4: "I"}
+
+
+def decode_word_usage(blob: bytes) -> Tuple[int, List[Tuple[int, int]]]:
+    # returns the total and (timestamp, count) per day
+    if blob[:1] == b"{":
+        word_data = orjson.loads(blob)
+        return word_data["total"], [
+            (int(bucket), count) for bucket, count in word_data["buckets"].items()
+        ]
+
+    _, width, total, first_day, length = WORD_USAGE_HEADER.unpack_from(blob)
+    start = WORD_USAGE_HEADER.size
+    offsets = struct.unpack_from(f"<{length}H", blob, start)
+    counts = struct.unpack_from(
+        f"<{length}{COUNT_FORMATS[width]}", blob, start + length * 2
+    )
+    first_timestamp = first_day * DAY_SECONDS
+    return total, [
+        (first_timestamp + offset * DAY_SECONDS, count)
+        for offset, count in zip(offsets, counts)
+    ]
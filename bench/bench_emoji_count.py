@@ -0,0 +1,68 @@
+import os
+import random
+import sys
+import time
+
+# compares counting inline emojis with one content.count() per emoji against
+# count_occurrences in derived.py, on synthetic messages with more and more
+# distinct emojis in them
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from derived import count_occurrences
+
+BENCH_MESSAGES = int(os.environ.get("BENCH_MESSAGES", "2000"))
+BENCH_EMOJIS = [
+    int(count) for count in os.environ.get("BENCH_EMOJIS", "1,3,10,50,200").split(",")
+]
+BENCH_REPEATS = int(os.environ.get("BENCH_REPEATS", "5"))
+BENCH_SEED = int(os.environ.get("BENCH_SEED", "1"))
+NATIVE_EMOJIS = ["👍", "👍🏽", "😂", "❤️", "🔥", "1️⃣", "💀", "🙏"]
+WORDS = ["lol", "the", "a", "ok", "what", "https://example.com/x:y", "12:30"]
+
+
+def make_message(rng: random.Random, distinct: int) -> tuple[str, list[str]]:
+    codes = [f":emoji{i}:" for i in range(distinct)]
+    codes[: len(NATIVE_EMOJIS) // 2] = NATIVE_EMOJIS[: min(distinct, 4)]
+    parts = []
+    for _ in range(distinct * BENCH_REPEATS):
+        parts.append(rng.choice(codes))
+        if rng.random() < 0.3:
+            parts.append(rng.choice(WORDS))
+    # spam often has no spaces between emojis
+    separator = "" if rng.random() < 0.5 else " "
+    return separator.join(parts), codes
+
+
+def count_each(content: str, codes: list[str]) -> dict:
+    return {code: content.count(code) for code in codes}
+
+
+def main():
+    rng = random.Random(BENCH_SEED)
+    print(
+        f"{'emojis':>8} {'chars':>8} {'count() ms':>12} {'one pass ms':>12} {'speedup':>8}"
+    )
+    for distinct in BENCH_EMOJIS:
+        messages = [make_message(rng, distinct) for _ in range(BENCH_MESSAGES)]
+        for content, codes in messages:
+            assert count_each(content, codes) == count_occurrences(content, codes)
+
+        start_time = time.perf_counter()
+        for content, codes in messages:
+            count_each(content, codes)
+        count_elapsed = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for content, codes in messages:
+            count_occurrences(content, codes)
+        pass_elapsed = time.perf_counter() - start_time
+
+        chars = sum(len(content) for content, _ in messages) // len(messages)
+        print(
+            f"{distinct:>8} {chars:>8} {count_elapsed * 1000:>12.1f} {pass_elapsed * 1000:>12.1f} {count_elapsed / pass_elapsed:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+import numpy as np
+import orjson
+
+# compares the memory held by the per user accumulators in aggregate.py with
+# the nested dicts process_users.py used to keep, on synthetic message rows
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from aggregate import EmojiAggregator, UserAggregator
+
+BENCH_MESSAGES = int(os.environ.get("BENCH_MESSAGES", "300000"))
+BENCH_USERS = int(os.environ.get("BENCH_USERS", "20000"))
+BENCH_EMOJIS = int(os.environ.get("BENCH_EMOJIS", "2000"))
+BENCH_CHUNK = int(os.environ.get("BENCH_CHUNK", "10000"))
+BENCH_SEED = int(os.environ.get("BENCH_SEED", "1"))
+
+
+def make_user(rng: random.Random) -> dict:
+    user_id = rng.randint(1, BENCH_USERS)
+    return {
+        "id": str(user_id << 22),
+        "name": f"user{user_id}",
+        "nickname": f"User {user_id}",
+        "avatarUrl": f"https://cdn.discordapp.com/avatars/{user_id << 22}/{user_id:032x}.png",
+        "isBot": False,
+    }
+
+
+def make_emoji(rng: random.Random) -> dict:
+    emoji_id = rng.randint(1, BENCH_EMOJIS)
+    return {
+        "id": str(emoji_id << 22),
+        "name": f"emoji{emoji_id}",
+        "code": f"emoji{emoji_id}",
+        "isAnimated": emoji_id % 5 == 0,
+    }
+
+
+def make_chunk(rng: random.Random, start: int, size: int) -> list[dict]:
+    rows = []
+    for message_id in range(start, start + size):
+        author = make_user(rng)
+        emojis = [make_emoji(rng) for _ in range(rng.choice((0, 0, 0, 1, 2)))]
+        row = {
+            "message_id": message_id,
+            "author_id": author["id"],
+            "author_name": author["name"],
+            "author_nickname": author["nickname"],
+            "author_avatar_url": author["avatarUrl"],
+            "content": " ".join(f":{emoji['code']}:" for emoji in emojis),
+            "hour_of_day": rng.randrange(24),
+            "attachments": [],
+            "reactions": [
+                {"emoji": make_emoji(rng), "users": [make_user(rng)]}
+                for _ in range(rng.choice((0, 0, 1)))
+            ],
+            "mentions": [make_user(rng) for _ in range(rng.choice((0, 0, 0, 1, 2)))],
+            "inline_emojis": emojis,
+        }
+        # a round trip through JSON, so every row has its own strings like rows
+        # read from sqlite do
+        rows.append(orjson.loads(orjson.dumps(row)))
+    return rows
+
+
+class DictUsers:
+    # the layout process_users.py had, kept here to measure against
+    def __init__(self):
+        self.user_cache = {}
+        self.user_emojis = {}
+
+    def init_user(self, user_id, user_name, user_nickname, avatar_url) -> dict:
+        if user_id not in self.user_cache:
+            self.user_cache[user_id] = {
+                "messages": 0,
+                "name": user_name,
+                "nickname": user_nickname,
+                "avatar_url": avatar_url,
+                "msg_frequency": {},
+                "reactions_given": 0,
+                "reactions_received": 0,
+                "attachments_sent": 0,
+                "attachments_size": 0,
+                "mentions_given": {},
+                "mentions_received": {},
+            }
+        return self.user_cache[user_id]
+
+    def count_emoji(self, user_id: int, emoji: dict, kind: str, amount: int):
+        emojis = self.user_emojis.setdefault(user_id, {})
+        emoji_id = emoji["id"] or emoji["name"]
+        if emoji_id not in emojis:
+            emojis[emoji_id] = {
+                "inline": 0,
+                "reactions": 0,
+                "native": emoji["id"] == "",
+                "animated": emoji["isAnimated"],
+            }
+        emojis[emoji_id][kind] += amount
+
+    def add(self, row: dict):
+        user_id = int(row["author_id"])
+        author = self.init_user(
+            user_id,
+            row["author_name"],
+            row["author_nickname"],
+            row["author_avatar_url"],
+        )
+        author["messages"] += 1
+        hour = row["hour_of_day"]
+        author["msg_frequency"][hour] = author["msg_frequency"].get(hour, 0) + 1
+        for emoji in row["inline_emojis"]:
+            self.count_emoji(
+                user_id, emoji, "inline", row["content"].count(f":{emoji['code']}:")
+            )
+        for reaction in row["reactions"]:
+            for user in reaction["users"]:
+                reactor = self.init_user(
+                    int(user["id"]), user["name"], user["nickname"], user["avatarUrl"]
+                )
+                reactor["reactions_given"] += 1
+                self.count_emoji(int(user["id"]), reaction["emoji"], "reactions", 1)
+        for position, mention in enumerate(row["mentions"]):
+            mentioned_id = int(mention["id"])
+            mentioned = self.init_user(
+                mentioned_id, mention["name"], mention["nickname"], mention["avatarUrl"]
+            )
+            for key, target, other_id, other in (
+                ("mentions_given", author, mentioned_id, mention),
+                ("mentions_received", mentioned, user_id, None),
+            ):
+                if other_id not in target[key]:
+                    target[key][other_id] = {
+                        "name": other["name"] if other else row["author_name"],
+                        "nickname": (
+                            other["nickname"] if other else row["author_nickname"]
+                        ),
+                        "avatar_url": (
+                            other["avatarUrl"] if other else row["author_avatar_url"]
+                        ),
+                        "count": 1,
+                        "first_message_id": row["message_id"],
+                        "first_position": position,
+                    }
+                else:
+                    target[key][other_id]["count"] += 1
+
+
+class SlotUsers:
+    def __init__(self):
+        self.emojis = EmojiAggregator()
+        self.users = UserAggregator(self.emojis)
+
+    def add_chunk(self, rows: list[dict]):
+        for row in rows:
+            self.users.add(row)
+            self.emojis.add(row)
+        self.users.add_arrays(
+            {
+                "author_id": np.array([int(row["author_id"]) for row in rows]),
+                "author_name": np.array(
+                    [row["author_name"] for row in rows], dtype=object
+                ),
+                "hour_of_day": np.array([row["hour_of_day"] for row in rows]),
+                "total_reactions": np.zeros(len(rows), dtype=np.int64),
+            }
+        )
+
+
+def build(kind: str) -> tuple[object, int]:
+    rng = random.Random(BENCH_SEED)
+    gc.collect()
+    tracemalloc.start()
+    state = DictUsers() if kind == "dicts" else SlotUsers()
+    for start in range(0, BENCH_MESSAGES, BENCH_CHUNK):
+        rows = make_chunk(rng, start, min(BENCH_CHUNK, BENCH_MESSAGES - start))
+        if kind == "dicts":
+            for row in rows:
+                state.add(row)
+        else:
+            state.add_chunk(rows)
+        del rows
+    if kind == "slots":
+        state.users.finish()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return state, retained
+
+
+def check(dicts: DictUsers, slots: SlotUsers):
+    users = slots.users
+    assert dicts.user_cache.keys() == users.user_cache.keys()
+    for user_id, user in dicts.user_cache.items():
+        record = users.user_cache[user_id]
+        assert user["messages"] == record.messages
+        assert user["msg_frequency"] == record.get_msg_frequency()
+        assert user["reactions_given"] == record.reactions_given
+        for key in ("mentions_given", "mentions_received"):
+            counts = {
+                other_id: edge.count for other_id, edge in getattr(record, key).items()
+            }
+            assert {
+                other_id: edge["count"] for other_id, edge in user[key].items()
+            } == counts
+        assert dicts.user_emojis.get(user_id, {}) == slots.emojis.get_emoji_data(
+            user_id
+        )
+
+
+def main():
+    # measured one after the other, so neither pays for the other's memory
+    dicts, dict_bytes = build("dicts")
+    slots, slot_bytes = build("slots")
+    check(dicts, slots)
+
+    print(f"{'layout':<14} {'users':>8} {'MB':>10} {'bytes/user':>12}")
+    for name, state, retained in (
+        ("nested dicts", dicts.user_cache, dict_bytes),
+        ("slot records", slots.users.user_cache, slot_bytes),
+    ):
+        print(
+            f"{name:<14} {len(state):>8} {retained / 1024 / 1024:>10.1f} {retained / len(state):>12.0f}"
+        )
+    print(f"{dict_bytes / slot_bytes:.1f}x less memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+import os
+import sys
+import time
+
+import numpy as np
+
+# compares the row by row bucket and hourly frequency aggregation with the
+# numpy one in aggregate.py, on synthetic rows shaped like a fetchmany() chunk
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from aggregate import BucketAggregator, EmojiAggregator, UserAggregator, get_arrays
+
+BENCH_ROWS = int(os.environ.get("BENCH_ROWS", "10000000"))
+BENCH_CHUNK = int(os.environ.get("BENCH_CHUNK", "100000"))
+BENCH_USERS = int(os.environ.get("BENCH_USERS", "1000"))
+BENCH_SEED = int(os.environ.get("BENCH_SEED", "1"))
+YEAR_START = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp())
+
+COLUMNS = (
+    "author_id",
+    "author_name",
+    "timestamp",
+    "day_bucket",
+    "hour_of_day",
+    "total_reactions",
+    "mention_count",
+)
+
+
+def make_chunk(rng: np.random.Generator, size: int) -> list[tuple]:
+    timestamps = np.sort(YEAR_START + rng.integers(0, 365 * 86400, size))
+    authors = rng.integers(1, BENCH_USERS + 1, size) << 22
+    columns = (
+        authors.tolist(),
+        [f"user{author}" for author in authors.tolist()],
+        timestamps.tolist(),
+        (timestamps - timestamps % 86400).tolist(),
+        (timestamps // 3600 % 24).tolist(),
+        rng.poisson(0.5, size).tolist(),
+        rng.poisson(0.1, size).tolist(),
+    )
+    return list(zip(*columns))
+
+
+def aggregate_datetime(rows: list[tuple], state: dict):
+    # what the scripts did before the derived columns, a datetime per message
+    # for the day and another for the hour
+    for author_id, _, timestamp, _, _, total_reactions, mention_count in rows:
+        dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+        bucket = str(int(dt.replace(hour=0, minute=0, second=0).timestamp()))
+        state["messages"][bucket] += 1
+        state["reactions"][bucket] += total_reactions
+        state["mentions"][bucket] += mention_count
+        hours = state["hours"][author_id]
+        hours[dt.hour] = hours.get(dt.hour, 0) + 1
+
+
+def aggregate_rows(rows: list[tuple], state: dict):
+    # row by row over the precomputed day_bucket and hour_of_day columns
+    for author_id, _, _, day_bucket, hour, total_reactions, mention_count in rows:
+        bucket = str(day_bucket)
+        state["messages"][bucket] += 1
+        state["reactions"][bucket] += total_reactions
+        state["mentions"][bucket] += mention_count
+        hours = state["hours"][author_id]
+        hours[hour] = hours.get(hour, 0) + 1
+
+
+def aggregate_arrays(rows: list[tuple], state: dict):
+    arrays = get_arrays(rows, COLUMNS, set(COLUMNS) - {"timestamp"})
+    state["buckets"].add_arrays(arrays)
+    state["users"].add_arrays(arrays)
+
+
+def make_row_state() -> dict:
+    return {
+        "messages": defaultdict(int),
+        "reactions": defaultdict(int),
+        "mentions": defaultdict(int),
+        "hours": defaultdict(dict),
+    }
+
+
+def make_array_state() -> dict:
+    users = UserAggregator(EmojiAggregator())
+    for i in range(1, BENCH_USERS + 1):
+        users.init_user(i << 22, f"user{i << 22}", None, None)
+    return {"buckets": BucketAggregator(), "users": users}
+
+
+def main():
+    rng = np.random.default_rng(BENCH_SEED)
+    runs = [
+        ("datetime per row", aggregate_datetime, make_row_state()),
+        ("derived columns per row", aggregate_rows, make_row_state()),
+        ("numpy per chunk", aggregate_arrays, make_array_state()),
+    ]
+    elapsed = defaultdict(float)
+    processed = 0
+    while processed < BENCH_ROWS:
+        rows = make_chunk(rng, min(BENCH_CHUNK, BENCH_ROWS - processed))
+        for name, aggregate, state in runs:
+            start_time = time.perf_counter()
+            aggregate(rows, state)
+            elapsed[name] += time.perf_counter() - start_time
+        processed += len(rows)
+        print(f"{processed}/{BENCH_ROWS}")
+
+    # all three have to agree before their timings mean anything
+    row_state = runs[1][2]
+    array_state = runs[2][2]
+    start_time = time.perf_counter()
+    array_state["users"].finish()
+    elapsed[runs[2][0]] += time.perf_counter() - start_time
+    assert runs[0][2]["messages"] == row_state["messages"]
+    assert dict(row_state["messages"]) == dict(array_state["buckets"].message_buckets)
+    assert dict(row_state["reactions"]) == dict(array_state["buckets"].reaction_buckets)
+    for user_id, hours in row_state["hours"].items():
+        assert hours == array_state["users"].user_cache[user_id].get_msg_frequency()
+
+    print()
+    print(f"{'method':<26} {'seconds':>10} {'rows/sec':>12} {'speedup':>8}")
+    baseline = elapsed[runs[0][0]]
+    for name, _, _ in runs:
+        print(
+            f"{name:<26} {elapsed[name]:>10.2f} {BENCH_ROWS / elapsed[name]:>12.0f} {baseline / elapsed[name]:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+from datetime import datetime, timezone
+import gzip
+from itertools import accumulate
+import os
+import random
+
+import orjson
+
+# writes DiscordChatExporter-shaped JSON exports with synthetic data, streamed
+# so very large exports never have to be held in memory
+GEN_OUTPUT_DIR = os.environ.get("GEN_OUTPUT_DIR", "export")
+GEN_YEAR = int(os.environ.get("GEN_YEAR", os.environ.get("CURRENT_YEAR", "2025")))
+GEN_MESSAGES = int(os.environ.get("GEN_MESSAGES", "10000"))
+GEN_CHANNELS = int(os.environ.get("GEN_CHANNELS", "8"))
+GEN_USERS = int(os.environ.get("GEN_USERS", "200"))
+GEN_EMOJIS = int(os.environ.get("GEN_EMOJIS", "100"))
+GEN_VOCABULARY = int(os.environ.get("GEN_VOCABULARY", "20000"))
+GEN_REACTION_RATE = float(os.environ.get("GEN_REACTION_RATE", "0.2"))
+GEN_MENTION_RATE = float(os.environ.get("GEN_MENTION_RATE", "0.1"))
+GEN_EMOJI_RATE = float(os.environ.get("GEN_EMOJI_RATE", "0.15"))
+GEN_ATTACHMENT_RATE = float(os.environ.get("GEN_ATTACHMENT_RATE", "0.05"))
+GEN_LINK_RATE = float(os.environ.get("GEN_LINK_RATE", "0.05"))
+GEN_BOT_RATE = float(os.environ.get("GEN_BOT_RATE", "0.02"))
+GEN_GZIP = os.environ.get("GEN_GZIP", "0") == "1"
+GEN_MEDIA_URL = os.environ.get("GEN_MEDIA_URL", "http://127.0.0.1:8765")
+GEN_SEED = int(os.environ.get("GEN_SEED", "1"))
+
+DISCORD_EPOCH_MS = 1420070400000
+NATIVE_EMOJIS = ["👍", "😂", "❤️", "🔥", "😭", "👀", "🎉", "💀", "🙏", "👍🏽"]
+ATTACHMENT_NAMES = ["image.png", "photo.jpg", "clip.mp4", "meme.gif", "video.mov"]
+
+
+def make_snowflake(timestamp_ms: int, sequence: int) -> str:
+    return str(((timestamp_ms - DISCORD_EPOCH_MS) << 22) | (sequence & 0x3FFFFF))
+
+
+def format_timestamp(timestamp_ms: int) -> str:
+    dt = datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)
+    # DiscordChatExporter drops the fraction when it is zero
+    if dt.microsecond == 0:
+        return dt.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+00:00"
+
+
+def make_users(rng: random.Random) -> list[dict]:
+    users = []
+    for i in range(GEN_USERS):
+        user_id = make_snowflake(DISCORD_EPOCH_MS + i * 1000, i)
+        users.append(
+            {
+                "id": user_id,
+                "name": f"user{i}",
+                "discriminator": "0000",
+                "nickname": f"User {i}",
+                "color": None,
+                "isBot": rng.random() < GEN_BOT_RATE,
+                "roles": [],
+                "avatarUrl": f"{GEN_MEDIA_URL}/avatars/{user_id}.png",
+            }
+        )
+    return users
+
+
+def make_emojis() -> list[dict]:
+    emojis = [
+        {
+            "id": "",
+            "name": name,
+            "code": f"native_{i}",
+            "isAnimated": False,
+            "imageUrl": f"{GEN_MEDIA_URL}/twemoji/{i}.svg",
+        }
+        for i, name in enumerate(NATIVE_EMOJIS)
+    ]
+    for i in range(GEN_EMOJIS):
+        emoji_id = make_snowflake(DISCORD_EPOCH_MS + i * 1000, 1000 + i)
+        animated = i % 7 == 0
+        emojis.append(
+            {
+                "id": emoji_id,
+                "name": f"emoji{i}",
+                "code": f"emoji{i}",
+                "isAnimated": animated,
+                "imageUrl": f"{GEN_MEDIA_URL}/emojis/{emoji_id}.{'gif' if animated else 'png'}",
+            }
+        )
+    return emojis
+
+
+def get_emoji_text(emoji: dict) -> str:
+    return emoji["name"] if emoji["id"] == "" else f":{emoji['code']}:"
+
+
+def make_vocabulary() -> tuple[list[str], list[float]]:
+    # zipf-like word frequencies, so a few words are very common and most are rare
+    vocabulary = [f"word{i}" for i in range(GEN_VOCABULARY)]
+    cum_weights = list(accumulate(1 / rank for rank in range(1, GEN_VOCABULARY + 1)))
+    return vocabulary, cum_weights
+
+
+def make_message(
+    rng: random.Random,
+    timestamp_ms: int,
+    sequence: int,
+    users: list[dict],
+    emojis: list[dict],
+    vocabulary: tuple[list[str], list[float]],
+) -> dict:
+    message_id = make_snowflake(timestamp_ms, sequence)
+    author = rng.choice(users)
+    words = rng.choices(vocabulary[0], cum_weights=vocabulary[1], k=rng.randint(1, 20))
+
+    inline_emojis = []
+    if rng.random() < GEN_EMOJI_RATE:
+        inline_emojis = rng.sample(emojis, rng.randint(1, 3))
+        for emoji in inline_emojis:
+            for _ in range(rng.randint(1, 3)):
+                words.insert(rng.randint(0, len(words)), get_emoji_text(emoji))
+
+    mentions = []
+    if rng.random() < GEN_MENTION_RATE:
+        mentions = rng.sample(users, rng.randint(1, 2))
+        words.extend(f"<@{user['id']}>" for user in mentions)
+
+    if rng.random() < GEN_LINK_RATE:
+        words.append(f"https://example.com/{rng.randint(0, 10**6)}")
+
+    reactions = []
+    if rng.random() < GEN_REACTION_RATE:
+        for emoji in rng.sample(emojis, rng.randint(1, 3)):
+            reactors = rng.sample(users, rng.randint(1, min(5, len(users))))
+            reactions.append(
+                {"emoji": emoji, "count": len(reactors), "users": reactors}
+            )
+
+    attachments = []
+    if rng.random() < GEN_ATTACHMENT_RATE:
+        attachment_id = make_snowflake(timestamp_ms, sequence + 1)
+        file_name = rng.choice(ATTACHMENT_NAMES)
+        attachments.append(
+            {
+                "id": attachment_id,
+                "url": f"{GEN_MEDIA_URL}/attachments/{attachment_id}/{file_name}",
+                "fileName": file_name,
+                "fileSizeBytes": rng.randint(10_000, 10_000_000),
+            }
+        )
+
+    return {
+        "id": message_id,
+        "type": "Default",
+        "timestamp": format_timestamp(timestamp_ms),
+        "timestampEdited": None,
+        "callEndedTimestamp": None,
+        "isPinned": False,
+        "content": " ".join(words),
+        "author": author,
+        "attachments": attachments,
+        "embeds": [],
+        "stickers": [],
+        "reactions": reactions,
+        "mentions": mentions,
+        "inlineEmojis": inline_emojis,
+    }
+
+
+def write_channel(
+    path: str,
+    channel_index: int,
+    message_count: int,
+    rng: random.Random,
+    sequence_start: int,
+    users: list[dict],
+    emojis: list[dict],
+    vocabulary: tuple[list[str], list[float]],
+):
+    year_start_ms = (
+        int(datetime(GEN_YEAR, 1, 1, tzinfo=timezone.utc).timestamp()) * 1000
+    )
+    year_length_ms = 365 * 86400 * 1000
+    timestamps = sorted(
+        year_start_ms + rng.randrange(year_length_ms) for _ in range(message_count)
+    )
+    channel_id = make_snowflake(DISCORD_EPOCH_MS + channel_index * 1000, channel_index)
+    header = {
+        "guild": {"id": "169611319501258753", "name": "Sail", "iconUrl": ""},
+        "channel": {
+            "id": channel_id,
+            "type": "GuildTextChat",
+            "categoryId": "0",
+            "category": "Text Channels",
+            "name": f"channel-{channel_index}",
+            "topic": None,
+        },
+        "dateRange": {"after": None, "before": None},
+        "exportedAt": format_timestamp(year_start_ms + year_length_ms),
+    }
+
+    opener = gzip.open if GEN_GZIP else open
+    with opener(path, "wb") as f:
+        f.write(orjson.dumps(header)[:-1] + b',"messages":[')
+        for i, timestamp_ms in enumerate(timestamps):
+            if i > 0:
+                f.write(b",")
+            # two sequence numbers per message, the second is for its attachment
+            sequence = sequence_start + i * 2
+            message = make_message(
+                rng, timestamp_ms, sequence, users, emojis, vocabulary
+            )
+            f.write(orjson.dumps(message))
+        f.write(b'],"messageCount":' + str(message_count).encode() + b"}")
+
+
+def generate():
+    rng = random.Random(GEN_SEED)
+    os.makedirs(GEN_OUTPUT_DIR, exist_ok=True)
+    users = make_users(rng)
+    emojis = make_emojis()
+    vocabulary = make_vocabulary()
+
+    per_channel = [GEN_MESSAGES // GEN_CHANNELS] * GEN_CHANNELS
+    per_channel[0] += GEN_MESSAGES - sum(per_channel)
+    extension = ".json.gz" if GEN_GZIP else ".json"
+    sequence_start = 0
+    for channel_index, message_count in enumerate(per_channel):
+        path = os.path.join(GEN_OUTPUT_DIR, f"channel-{channel_index}{extension}")
+        print(f"Writing {message_count} messages to {path}")
+        write_channel(
+            path,
+            channel_index,
+            message_count,
+            rng,
+            sequence_start,
+            users,
+            emojis,
+            vocabulary,
+        )
+        sequence_start += message_count * 2
+
+
+if __name__ == "__main__":
+    generate()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+# runs the processing scripts against synthetic exports of increasing size and
+# reports wall time, throughput and peak RSS for each of them
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.environ.get("BENCH_DIR", "bench_data")
+BENCH_SIZES = [
+    int(size)
+    for size in os.environ.get("BENCH_SIZES", "10000,1000000,10000000").split(",")
+]
+# BENCH_SCRIPTS is a comma separated list of scripts or one of these names.
+# baseline is the two aggregate passes of process_static_data.py and
+# process_users.py that aggregate.py replaced
+BENCH_SCRIPT_SETS = {
+    "single_pass": "process.py,aggregate.py",
+    "baseline": "process.py,process_static_data.py,process_users.py",
+}
+BENCH_SCRIPTS = os.environ.get("BENCH_SCRIPTS", "single_pass")
+BENCH_SCRIPTS = BENCH_SCRIPT_SETS.get(BENCH_SCRIPTS, BENCH_SCRIPTS).split(",")
+BENCH_REUSE = os.environ.get("BENCH_REUSE", "1") == "1"
+CURRENT_YEAR = os.environ.get("CURRENT_YEAR", "2025")
+
+
+def run_script(args: list[str], cwd: str, env: dict) -> tuple[float, float, int]:
+    # os.wait4 gives the rusage of this child only, so peak RSS isn't mixed up
+    # with the other scripts
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        args, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start_time
+    stderr = process.stderr.read().decode(errors="replace")
+    process.stderr.close()
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code != 0:
+        print(stderr, file=sys.stderr)
+    # ru_maxrss is in KiB on linux
+    return elapsed, rusage.ru_maxrss / 1024, exit_code
+
+
+def prepare(size: int, env: dict) -> str:
+    work_dir = os.path.abspath(os.path.join(BENCH_DIR, str(size)))
+    export_dir = os.path.join(work_dir, "export")
+    if not (BENCH_REUSE and os.path.isdir(export_dir)):
+        shutil.rmtree(work_dir, ignore_errors=True)
+        print(f"Generating {size} messages")
+        generate_env = {**env, "GEN_MESSAGES": str(size), "GEN_OUTPUT_DIR": export_dir}
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT_DIR, "bench", "generate_export.py")],
+            env=generate_env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+    # every run starts from an empty database
+    db_dir = os.path.join(work_dir, "backend")
+    shutil.rmtree(db_dir, ignore_errors=True)
+    os.makedirs(db_dir)
+    conn = sqlite3.connect(os.path.join(db_dir, "wrapped.db"))
+    with open(os.path.join(ROOT_DIR, "schema.sql"), "r") as f:
+        conn.executescript(f.read())
+    conn.close()
+    return work_dir
+
+
+def main():
+    env = {**os.environ, "CURRENT_YEAR": CURRENT_YEAR, "DOWNLOAD_MEDIA": "0"}
+    results = []
+    for size in BENCH_SIZES:
+        work_dir = prepare(size, env)
+        for script in BENCH_SCRIPTS:
+            print(f"Running {script} on {size} messages")
+            elapsed, peak_rss, exit_code = run_script(
+                [sys.executable, os.path.join(ROOT_DIR, script)], work_dir, env
+            )
+            results.append((script, size, elapsed, peak_rss, exit_code))
+            if exit_code != 0:
+                print(f"{script} exited with {exit_code}")
+                break
+
+    print()
+    print(
+        f"{'script':<24} {'messages':>10} {'seconds':>10} {'msgs/sec':>10} {'peak RSS MB':>12}"
+    )
+    for script, size, elapsed, peak_rss, exit_code in results:
+        throughput = f"{size / elapsed:.0f}" if exit_code == 0 else "failed"
+        print(
+            f"{script:<24} {size:>10} {elapsed:>10.2f} {throughput:>10} {peak_rss:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import sqlite3
+
+from derived import EXCLUDED_EXTENSIONS, VIDEO_EXTENSIONS
+
+# secondary indexes on messages that are expensive to maintain row by row;
+# bulk loads drop these and rebuild them once at the end
+MESSAGE_INDEXES = {
+    "idx_messages_content": 'CREATE INDEX IF NOT EXISTS "idx_messages_content" ON "messages" ("content")',
+    "idx_messages_total_reactions": 'CREATE INDEX IF NOT EXISTS "idx_messages_total_reactions" ON "messages" ("total_reactions")',
+    "idx_messages_year": 'CREATE INDEX IF NOT EXISTS "idx_messages_year" ON "messages" ("year")',
+    "idx_messages_year_has_link_content_length": 'CREATE INDEX IF NOT EXISTS "idx_messages_year_has_link_content_length" ON "messages" ("year", "has_link", "content_length")',
+    "idx_messages_year_day_bucket": 'CREATE INDEX IF NOT EXISTS "idx_messages_year_day_bucket" ON "messages" ("year", "day_bucket")',
+}
+
+# like_counts holds the number of likes of each liked attachment and message,
+# kept in step with likes and message_likes by these triggers so the backend
+# can read counts for a page of items by primary key. backend/async_db.py and
+# schema.sql create them too, tests/test_schema.py checks the copies match
+LIKE_COUNT_TRIGGERS = {
+    "likes_count_insert": 'CREATE TRIGGER IF NOT EXISTS "likes_count_insert" AFTER INSERT ON "likes" BEGIN INSERT INTO like_counts VALUES (1, NEW.attachment_id, 1) ON CONFLICT (is_attachment, entity_id) DO UPDATE SET count = count + 1; END',
+    "likes_count_delete": 'CREATE TRIGGER IF NOT EXISTS "likes_count_delete" AFTER DELETE ON "likes" BEGIN UPDATE like_counts SET count = count - 1 WHERE is_attachment = 1 AND entity_id = OLD.attachment_id; DELETE FROM like_counts WHERE is_attachment = 1 AND entity_id = OLD.attachment_id AND count <= 0; END',
+    "message_likes_count_insert": 'CREATE TRIGGER IF NOT EXISTS "message_likes_count_insert" AFTER INSERT ON "message_likes" BEGIN INSERT INTO like_counts VALUES (0, NEW.message_id, 1) ON CONFLICT (is_attachment, entity_id) DO UPDATE SET count = count + 1; END',
+    "message_likes_count_delete": 'CREATE TRIGGER IF NOT EXISTS "message_likes_count_delete" AFTER DELETE ON "message_likes" BEGIN UPDATE like_counts SET count = count - 1 WHERE is_attachment = 0 AND entity_id = OLD.message_id; DELETE FROM like_counts WHERE is_attachment = 0 AND entity_id = OLD.message_id AND count <= 0; END',
+}
+
+
+# trade durability for speed while loading; end_bulk_load puts back whatever
+# was set before
+BULK_LOAD_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": "-262144",
+}
+
+
+def begin_bulk_load(conn: sqlite3.Connection) -> dict:
+    previous = {
+        pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+        for pragma in BULK_LOAD_PRAGMAS
+    }
+    for pragma, value in BULK_LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    for index_name in MESSAGE_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS "{index_name}"')
+    conn.commit()
+    return previous
+
+
+def end_bulk_load(conn: sqlite3.Connection, previous: dict):
+    for index_name, index_sql in MESSAGE_INDEXES.items():
+        print(f"Rebuilding index {index_name}")
+        conn.execute(index_sql)
+    conn.commit()
+    print("Analyzing")
+    conn.execute("ANALYZE")
+    conn.commit()
+    for pragma, value in previous.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+
+def add_missing_columns(conn: sqlite3.Connection, table: str, columns: dict):
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+    for column, column_type in columns.items():
+        if column not in existing:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {column_type}')
+
+
+def ensure_tables(conn: sqlite3.Connection):
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "downloads" ("path" TEXT PRIMARY KEY, "url" TEXT, "kind" TEXT, "ref_id" INTEGER, "status" TEXT, "attempts" INTEGER, "error" TEXT, "updated_at" INTEGER)'
+    )
+    add_missing_columns(conn, "downloads", {"content_hash": "TEXT", "size": "INTEGER"})
+    add_missing_columns(
+        conn,
+        "attachments",
+        {
+            "content_hash": "TEXT",
+            "size": "INTEGER",
+            "media_type": "TEXT",
+            # set while the attachment's download has failed
+            "missing": "INTEGER DEFAULT 0",
+        },
+    )
+    add_missing_columns(
+        conn,
+        "messages",
+        {
+            "has_link": "INTEGER",
+            "mention_count": "INTEGER",
+            "reaction_kinds": "INTEGER",
+            "day_bucket": "INTEGER",
+            "hour_of_day": "INTEGER",
+        },
+    )
+    for index_sql in MESSAGE_INDEXES.values():
+        conn.execute(index_sql)
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_attachments_year_media_type" ON "attachments" ("year", "media_type")'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_downloads_status_url" ON "downloads" ("status", "url")'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "message_reactions" ("message_id" INTEGER, "emoji_id" TEXT, "user_id" INTEGER, PRIMARY KEY ("message_id", "emoji_id", "user_id")) WITHOUT ROWID'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_message_reactions_user_id" ON "message_reactions" ("user_id")'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_message_reactions_emoji_id" ON "message_reactions" ("emoji_id")'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "message_mentions" ("message_id" INTEGER, "user_id" INTEGER, PRIMARY KEY ("message_id", "user_id")) WITHOUT ROWID'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_message_mentions_user_id" ON "message_mentions" ("user_id")'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "message_emojis" ("message_id" INTEGER, "emoji_id" TEXT, "count" INTEGER, PRIMARY KEY ("message_id", "emoji_id")) WITHOUT ROWID'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_message_emojis_emoji_id" ON "message_emojis" ("emoji_id")'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "emojis" ("emoji_id" TEXT PRIMARY KEY, "name" TEXT, "code" TEXT, "animated" INTEGER, "native" INTEGER, "image_url" TEXT)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "members" ("user_id" INTEGER PRIMARY KEY, "name" TEXT, "nickname" TEXT, "avatar_url" TEXT, "is_bot" INTEGER)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "ingest_manifest" ("file_name" TEXT PRIMARY KEY, "size" INTEGER, "mtime" INTEGER, "content_hash" TEXT, "max_message_id" INTEGER, "status" TEXT, "updated_at" INTEGER)'
+    )
+    add_missing_columns(conn, "users", {"msg_frequency": "BLOB"})
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_users_year_user_id" ON "users" ("year", "user_id")'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "mention_edges" ("year" INTEGER, "from_user_id" INTEGER, "to_user_id" INTEGER, "from_name" TEXT, "to_name" TEXT, "count" INTEGER, "first_message_id" INTEGER, "first_position" INTEGER, PRIMARY KEY ("year", "from_user_id", "to_user_id"))'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_mention_edges_year_count" ON "mention_edges" ("year", "count")'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_mention_edges_year_from_count" ON "mention_edges" ("year", "from_user_id", "count")'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_mention_edges_year_to_count" ON "mention_edges" ("year", "to_user_id", "count")'
+    )
+    ensure_like_counts(conn)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "aggregate_watermarks" ("year" INTEGER, "name" TEXT, "max_message_id" INTEGER, "message_count" INTEGER, "updated_at" INTEGER, PRIMARY KEY ("year", "name"))'
+    )
+    conn.commit()
+
+
+def ensure_like_counts(conn: sqlite3.Connection):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'like_counts'"
+    ).fetchone()
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS "like_counts" ("is_attachment" INTEGER, "entity_id" INTEGER, "count" INTEGER, PRIMARY KEY ("is_attachment", "entity_id")) WITHOUT ROWID'
+    )
+    if not exists:
+        # likes made before the triggers existed
+        conn.execute(
+            "INSERT INTO like_counts SELECT 1, attachment_id, COUNT(*) FROM likes GROUP BY attachment_id"
+        )
+        conn.execute(
+            "INSERT INTO like_counts SELECT 0, message_id, COUNT(*) FROM message_likes GROUP BY message_id"
+        )
+        print("Backfilled like counts")
+    for trigger_sql in LIKE_COUNT_TRIGGERS.values():
+        conn.execute(trigger_sql)
+
+
+def backfill_derived_columns(conn: sqlite3.Connection):
+    # fills the derived columns for rows ingested before they existed, using
+    # the same rules as derived.py
+    video_list = ", ".join(f"'{extension}'" for extension in VIDEO_EXTENSIONS)
+    excluded_list = ", ".join(f"'{extension}'" for extension in EXCLUDED_EXTENSIONS)
+    cursor = conn.execute(
+        "UPDATE messages SET "
+        + "has_link = (content LIKE '%http://%' OR content LIKE '%https://%'), "
+        + "mention_count = json_array_length(CAST(mentions AS TEXT)), "
+        + "reaction_kinds = json_array_length(CAST(reactions AS TEXT)), "
+        + "day_bucket = timestamp - timestamp % 86400, "
+        + "hour_of_day = timestamp / 3600 % 24 "
+        + "WHERE day_bucket IS NULL"
+    )
+    if cursor.rowcount > 0:
+        print(f"Backfilled derived columns for {cursor.rowcount} message(s)")
+    cursor = conn.execute(
+        "UPDATE attachments SET media_type = CASE "
+        + f"WHEN lower(extension) IN ({video_list}) THEN 'video' "
+        + f"WHEN lower(extension) IN ({excluded_list}) THEN 'excluded' "
+        + "ELSE 'image' END WHERE media_type IS NULL"
+    )
+    if cursor.rowcount > 0:
+        print(f"Backfilled media types for {cursor.rowcount} attachment(s)")
+    conn.commit()
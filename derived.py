@@ -0,0 +1,146 @@
+from collections import Counter
+from functools import lru_cache
+from itertools import groupby
+from operator import eq
+import re
+
+# keep in sync with VIDEO_EXT_LIST and EXCLUDED_EXTENSIONS in backend/consts.py
+VIDEO_EXTENSIONS = {
+    ".webm",
+    ".mkv",
+    ".flv",
+    ".vob",
+    ".ogv",
+    ".ogg",
+    ".rrc",
+    ".gifv",
+    ".mng",
+    ".mov",
+    ".avi",
+    ".qt",
+    ".wmv",
+    ".yuv",
+    ".rm",
+    ".asf",
+    ".amv",
+    ".mp4",
+    ".m4p",
+    ".m4v",
+    ".mpg",
+    ".mp2",
+    ".mpeg",
+    ".mpe",
+    ".mpv",
+    ".svi",
+    ".3gp",
+    ".3g2",
+    ".mxf",
+    ".roq",
+    ".nsv",
+    ".f4v",
+    ".f4p",
+    ".f4a",
+    ".f4b",
+    ".mod",
+}
+EXCLUDED_EXTENSIONS = {".yaml", ".zip"}
+
+
+def get_media_type(extension: str) -> str:
+    extension = extension.lower()
+    if extension in VIDEO_EXTENSIONS:
+        return "video"
+    if extension in EXCLUDED_EXTENSIONS:
+        return "excluded"
+    return "image"
+
+
+def has_link(content: str) -> bool:
+    # same match as the LIKE '%http://%' / '%https://%' filter it replaces,
+    # which is case insensitive
+    content = content.lower()
+    return "http://" in content or "https://" in content
+
+
+def get_day_bucket(timestamp: int) -> int:
+    return timestamp - timestamp % 86400
+
+
+def get_hour_of_day(timestamp: int) -> int:
+    return timestamp // 3600 % 24
+
+
+def get_emoji_code(emoji: dict) -> str:
+    # how an inline emoji appears in the message content
+    return emoji["name"] if emoji["id"] == "" else f":{emoji['code']}:"
+
+
+# count() scans at memory speed, so below this many distinct emojis of a kind
+# one count() each is still faster than a single pass in python
+COLON_PASS_THRESHOLD = 24
+NATIVE_PASS_THRESHOLD = 16
+
+
+@lru_cache(maxsize=4096)
+def has_border(pattern: str) -> bool:
+    # a pattern that starts with one of its own suffixes can overlap itself
+    return any(pattern[:i] == pattern[-i:] for i in range(1, len(pattern)))
+
+
+@lru_cache(maxsize=4096)
+def get_alternation_pattern(patterns: tuple) -> re.Pattern:
+    return re.compile("(?=(" + "|".join(map(re.escape, patterns)) + "))")
+
+
+def count_colon_codes(content: str) -> Counter:
+    # a custom emoji ":code:" has no colon inside, so one starting at a colon
+    # can only end at the next one, and the text between consecutive colons is
+    # every candidate code. two equal neighbours like ":a:a:" share a colon,
+    # count() only sees every other one of those
+    names = content.split(":")[1:-1]
+    if not any(map(eq, names, names[1:])):
+        return Counter(names)
+    found = Counter()
+    for name, run in groupby(names):
+        found[name] += (len(list(run)) + 1) // 2
+    return found
+
+
+def count_occurrences(content: str, patterns) -> dict:
+    # same result as content.count(pattern) for every pattern, without a scan
+    # of content per custom emoji
+    counts = dict.fromkeys(patterns, 0)
+    colon_codes = []
+    others = []
+    for pattern in counts:
+        if len(pattern) >= 2 and pattern[0] == pattern[-1] == ":":
+            if ":" not in pattern[1:-1]:
+                colon_codes.append(pattern)
+                continue
+        others.append(pattern)
+
+    if len(colon_codes) < COLON_PASS_THRESHOLD:
+        others.extend(colon_codes)
+    else:
+        found = count_colon_codes(content)
+        for code in colon_codes:
+            counts[code] = found[code[1:-1]]
+
+    if len(others) < NATIVE_PASS_THRESHOLD:
+        for pattern in others:
+            counts[pattern] = content.count(pattern)
+        return counts
+
+    # one regex pass finds at most one pattern per position, so patterns that
+    # can overlap themselves or are a prefix of another one are counted alone
+    others.sort()
+    alternated = []
+    for pattern, following in zip(others, others[1:] + [""]):
+        if pattern == "" or has_border(pattern) or following.startswith(pattern):
+            counts[pattern] = content.count(pattern)
+        else:
+            alternated.append(pattern)
+    found = Counter(get_alternation_pattern(tuple(alternated)).findall(content))
+    for pattern in alternated:
+        counts[pattern] = found[pattern]
+    return counts
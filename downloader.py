@@ -0,0 +1,202 @@
+import asyncio
+from collections import defaultdict
+import hashlib
+import os
+import pathlib
+import random
+import shutil
+import sqlite3
+import time
+
+import aiohttp
+
+from db import ensure_tables
+from export_reader import hash_file
+
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "16"))
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", "4"))
+DOWNLOAD_TIMEOUT = float(os.environ.get("DOWNLOAD_TIMEOUT", "30"))
+RETRY_BACKOFF = 0.5
+CHUNK_SIZE = 1 << 16
+ATTACHMENT_DIR = "attachments"
+
+
+class RetryableDownloadError(Exception):
+    pass
+
+
+class PermanentDownloadError(Exception):
+    pass
+
+
+def enqueue_downloads(conn: sqlite3.Connection, rows: list):
+    # rows are (path, url, kind, ref_id); a changed url for an existing path
+    # (e.g. a new avatar) puts the path back in the queue. Attachment content
+    # never changes, so a stored attachment stays done even though its signed
+    # cdn url is different in every export
+    now = int(time.time())
+    conn.executemany(
+        "INSERT INTO downloads (path, url, kind, ref_id, status, attempts, updated_at) VALUES (?, ?, ?, ?, 'pending', 0, ?) "
+        + "ON CONFLICT (path) DO UPDATE SET url = excluded.url, ref_id = excluded.ref_id, updated_at = excluded.updated_at, "
+        + "status = CASE WHEN downloads.kind = 'attachment' AND downloads.status = 'done' THEN 'done' ELSE 'pending' END, "
+        + "attempts = CASE WHEN downloads.kind = 'attachment' AND downloads.status = 'done' THEN downloads.attempts ELSE 0 END "
+        + "WHERE downloads.url != excluded.url",
+        [(*row, now) for row in rows],
+    )
+
+
+def get_blob_path(content_hash: str, extension: str) -> str:
+    return f"{ATTACHMENT_DIR}/{content_hash}{extension}"
+
+
+async def fetch_to_file(
+    session: aiohttp.ClientSession, url: str, path: str, retries: int
+) -> tuple[str, int]:
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url) as res:
+                if res.status == 429 or res.status >= 500:
+                    raise RetryableDownloadError(f"HTTP {res.status}")
+                if res.status >= 400:
+                    raise PermanentDownloadError(f"HTTP {res.status}")
+
+                tmp_path = f"{path}.part"
+                digest = hashlib.sha256()
+                size = 0
+                with open(tmp_path, "wb") as f:
+                    async for chunk in res.content.iter_chunked(CHUNK_SIZE):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                os.replace(tmp_path, path)
+                return digest.hexdigest(), size
+        except (RetryableDownloadError, aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == retries:
+                raise
+            await asyncio.sleep(RETRY_BACKOFF * 2**attempt * (1 + random.random()))
+
+
+async def store_attachment(
+    session: aiohttp.ClientSession,
+    url: str,
+    path: str,
+    ref_id: int,
+    retries: int,
+) -> tuple[str, int]:
+    # attachments are stored once per distinct content as <sha256><ext>; path
+    # is only the legacy <id>_<file name> location used as the queue key
+    extension = pathlib.Path(path).suffix.lower()
+    if os.path.exists(path):
+        # downloaded by a run from before the store existed
+        tmp_path = path
+        content_hash, size = hash_file(path), os.path.getsize(path)
+    else:
+        tmp_path = f"{ATTACHMENT_DIR}/{ref_id}.tmp"
+        content_hash, size = await fetch_to_file(session, url, tmp_path, retries)
+
+    blob_path = get_blob_path(content_hash, extension)
+    if os.path.exists(blob_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, blob_path)
+    return content_hash, size
+
+
+async def run_downloads(
+    conn: sqlite3.Connection,
+    concurrency: int = DOWNLOAD_CONCURRENCY,
+    retries: int = DOWNLOAD_RETRIES,
+    timeout: float = DOWNLOAD_TIMEOUT,
+):
+    ensure_tables(conn)
+    # gone is a 4xx other than 429, only tried again when an export brings a
+    # new url for the path
+    rows = conn.execute(
+        "SELECT url, path, kind, ref_id FROM downloads WHERE status NOT IN ('done', 'gone') ORDER BY rowid"
+    ).fetchall()
+
+    # the same url can be queued for several paths, fetch it once and copy
+    paths_by_url = defaultdict(list)
+    for url, *entry in rows:
+        paths_by_url[url].append(entry)
+
+    total = len(paths_by_url)
+    print(f"Downloading {total} url(s) for {len(rows)} file(s)")
+    if total == 0:
+        return 0, 0
+
+    results = {"done": 0, "failed": 0}
+
+    def set_status(
+        url: str,
+        status: str,
+        error: str | None,
+        content_hash: str | None = None,
+        size: int | None = None,
+    ):
+        conn.execute(
+            "UPDATE downloads SET status = ?, attempts = attempts + 1, error = ?, content_hash = ?, size = ?, updated_at = ? WHERE url = ?",
+            (status, error, content_hash, size, int(time.time()), url),
+        )
+        # attachments whose download failed are kept but hidden from the
+        # backend, and shown again once a retry succeeds
+        if content_hash:
+            conn.execute(
+                "UPDATE attachments SET content_hash = ?, size = ?, missing = 0 WHERE id IN (SELECT ref_id FROM downloads WHERE url = ? AND kind = 'attachment')",
+                (content_hash, size, url),
+            )
+        else:
+            conn.execute(
+                "UPDATE attachments SET missing = 1 WHERE id IN (SELECT ref_id FROM downloads WHERE url = ? AND kind = 'attachment')",
+                (url,),
+            )
+        results["done" if status == "done" else "failed"] += 1
+        finished = results["done"] + results["failed"]
+        if finished % 100 == 0 or finished == total:
+            print(f"Downloaded {finished}/{total} ({results['failed']} failed)")
+            conn.commit()
+
+    pending = iter(paths_by_url.items())
+
+    async def worker(session: aiohttp.ClientSession):
+        # a fixed number of workers pull from the queue, so a slow response only
+        # holds up its own slot
+        for url, entries in pending:
+            path, kind, ref_id = entries[0]
+            try:
+                if kind == "attachment":
+                    content_hash, size = await store_attachment(
+                        session, url, path, ref_id, retries
+                    )
+                else:
+                    content_hash, size = await fetch_to_file(
+                        session, url, path, retries
+                    )
+                    for other_path, *_ in entries[1:]:
+                        shutil.copyfile(path, other_path)
+                set_status(url, "done", None, content_hash, size)
+            except PermanentDownloadError as e:
+                print(f"Error downloading {url}: {type(e).__name__} {e}")
+                set_status(url, "gone", f"{type(e).__name__}: {e}")
+            except Exception as e:
+                print(f"Error downloading {url}: {type(e).__name__} {e}")
+                set_status(url, "failed", f"{type(e).__name__}: {e}")
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    # no total timeout so large attachments can finish, but a stalled
+    # connection gives up
+    client_timeout = aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=client_timeout
+    ) as session:
+        await asyncio.gather(*(worker(session) for _ in range(min(concurrency, total))))
+
+    conn.commit()
+    return results["done"], results["failed"]
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect("backend/wrapped.db")
+    done, failed = asyncio.run(run_downloads(conn))
+    print(f"Done - {done} downloaded, {failed} failed")
+    conn.close()
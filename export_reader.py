@@ -0,0 +1,47 @@
+import gzip
+import hashlib
+import os
+from typing import Iterator
+
+import ijson
+
+EXPORT_EXTENSIONS = (".json", ".json.gz")
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def list_export_files(directory: str) -> list[str]:
+    return sorted(
+        file_name
+        for file_name in os.listdir(directory)
+        if file_name.endswith(EXPORT_EXTENSIONS)
+    )
+
+
+def open_export(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_channel(path: str) -> dict:
+    # DiscordChatExporter writes "guild" and "channel" before "messages", so this
+    # only reads the head of the file
+    with open_export(path) as f:
+        for channel in ijson.items(f, "channel"):
+            return channel
+    return {}
+
+
+def iter_messages(path: str) -> Iterator[dict]:
+    # yields one message at a time from the "messages" array, so memory stays
+    # bounded by the largest single message rather than the whole export
+    with open_export(path) as f:
+        yield from ijson.items(f, "messages.item", use_float=True)
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
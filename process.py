@@ -1,151 +1,437 @@
+from collections import defaultdict
 from datetime import datetime
+import multiprocessing
 import os
+import queue
 import time
+import traceback
+import asyncio
 import orjson
-import requests
 import sqlite3
 import pathlib
 
-json_files = os.listdir("export")
-file_count = len(json_files)
-conn = sqlite3.connect("backend/wrapped.db")
+from db import begin_bulk_load, backfill_derived_columns, end_bulk_load, ensure_tables
+from derived import (
+    count_occurrences,
+    get_day_bucket,
+    get_emoji_code,
+    get_hour_of_day,
+    get_media_type,
+    has_link,
+)
+from downloader import enqueue_downloads, run_downloads
+from export_reader import hash_file, iter_messages, list_export_files, read_channel
+from sidecar import get_ingest_stamp, write_sidecars
 
 CURRENT_YEAR = int(os.environ.get("CURRENT_YEAR", "2025"))
-
-print("Current year:", CURRENT_YEAR)
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "export")
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "1"))
+BULK_LOAD = os.environ.get("BULK_LOAD", "0") == "1"
+INGEST_FORCE = os.environ.get("INGEST_FORCE", "0") == "1"
+DOWNLOAD_MEDIA = os.environ.get("DOWNLOAD_MEDIA", "1") == "1"
+WRITE_SIDECAR = os.environ.get("WRITE_SIDECAR", "1") == "1"
+BATCH_SIZE = 500
+# how often the parallel ingest checks that its workers are still alive while
+# waiting for results
+WORKER_POLL_SECONDS = 1
 
 seen_emojis = set()
 
-export_directories = {"attachments", "emojis", "avatars"}
-for directory in export_directories:
-    os.makedirs(directory, exist_ok=True)
-
-for i, file_name in enumerate(json_files):
-    print(f"Processing file {i + 1}/{file_count} - {file_name}")
-    with open(f"export/{file_name}", "r", encoding="utf-8") as f:
-        start_time = int(time.time())
-        logs = orjson.loads(f.read())
-        end_time = int(time.time())
-        channel_id = int(logs.get("channel", {}).get("id", "0"))
-        channel_name = logs.get("channel", {}).get("name")
-
-        print(f"Loaded into memory - {channel_id} - {channel_name}")
-        print(f"Took {end_time - start_time} second(s)")
-
-        log_messages = logs.get("messages", [])
-        message_count = len(log_messages)
-        print(f"Parsing through {message_count} messages")
-        for j, message in enumerate(log_messages):
-            if j % 500 == 0:
-                print(
-                    f"Process {j + 1}/{message_count} - {channel_id} - {channel_name}"
-                )
-                conn.commit()
 
-            if message["author"]["isBot"]:
-                continue
+def get_member_row(user: dict) -> tuple:
+    return (
+        int(user.get("id", "0")),
+        user.get("name", ""),
+        user.get("nickname", ""),
+        user.get("avatarUrl", ""),
+        user.get("isBot", False),
+    )
 
-            message_id = int(message["id"])
-            type = message["type"]
 
-            formatted_timestamp = message["timestamp"]
-            if "." not in formatted_timestamp:
-                formatted_timestamp = (
-                    formatted_timestamp.replace("+00:00", "") + ".0+00:00"
-                )
+def parse_message(message: dict, channel_id: int, channel_name: str, batch: dict):
+    if message["author"]["isBot"]:
+        return
 
-            timestamp = int(
-                datetime.strptime(
-                    formatted_timestamp, "%Y-%m-%dT%H:%M:%S.%f%z"
-                ).timestamp()
-            )
-            content = message["content"]
-            author_id = int(message["author"].get("id", "0"))
-            author_name = message["author"].get("name", "")
-            author_nickname = message["author"].get("nickname", "")
-            author_discriminator = message["author"].get("discriminator", "0000")
-            author_avatar_url = message["author"].get("avatarUrl", "")
-            attachments = orjson.dumps(message["attachments"])
-            embeds = orjson.dumps(message["embeds"])
-            stickers = orjson.dumps(message["stickers"])
-            reactions = orjson.dumps(message["reactions"])
-            mentions = orjson.dumps(message["mentions"])
-            total_reactions = sum(
-                [reaction["count"] for reaction in message["reactions"]]
+    message_id = int(message["id"])
+    type = message["type"]
+
+    formatted_timestamp = message["timestamp"]
+    if "." not in formatted_timestamp:
+        formatted_timestamp = formatted_timestamp.replace("+00:00", "") + ".0+00:00"
+
+    timestamp = int(
+        datetime.strptime(formatted_timestamp, "%Y-%m-%dT%H:%M:%S.%f%z").timestamp()
+    )
+    content = message["content"]
+    author_id = int(message["author"].get("id", "0"))
+    author_name = message["author"].get("name", "")
+    author_nickname = message["author"].get("nickname", "")
+    author_discriminator = message["author"].get("discriminator", "0000")
+    author_avatar_url = message["author"].get("avatarUrl", "")
+    attachments = orjson.dumps(message["attachments"])
+    embeds = orjson.dumps(message["embeds"])
+    stickers = orjson.dumps(message["stickers"])
+    reactions = orjson.dumps(message["reactions"])
+    mentions = orjson.dumps(message["mentions"])
+    total_reactions = sum([reaction["count"] for reaction in message["reactions"]])
+    inline_emojis = orjson.dumps(message["inlineEmojis"])
+
+    message_row = (
+        message_id,
+        type,
+        timestamp,
+        content,
+        author_id,
+        author_name,
+        author_nickname,
+        author_discriminator,
+        author_avatar_url,
+        attachments,
+        embeds,
+        stickers,
+        reactions,
+        total_reactions,
+        mentions,
+        inline_emojis,
+        channel_id,
+        channel_name,
+        len(content),
+        CURRENT_YEAR,
+        has_link(content),
+        len(message["mentions"]),
+        len(message["reactions"]),
+        get_day_bucket(timestamp),
+        get_hour_of_day(timestamp),
+    )
+
+    batch["messages"].append(message_row)
+
+    # normalized copies of the json columns
+    batch["members"].append(get_member_row(message["author"]))
+    for reaction in message["reactions"]:
+        emoji_id = reaction["emoji"]["id"] or reaction["emoji"]["name"]
+        for user in reaction["users"]:
+            batch["members"].append(get_member_row(user))
+            batch["message_reactions"].append((message_id, emoji_id, int(user["id"])))
+
+    for mention in message["mentions"]:
+        batch["members"].append(get_member_row(mention))
+        batch["message_mentions"].append((message_id, int(mention["id"])))
+
+    emoji_counts = count_occurrences(
+        content, [get_emoji_code(emoji) for emoji in message["inlineEmojis"]]
+    )
+    for emoji in message["inlineEmojis"]:
+        emoji_id = emoji["id"] or emoji["name"]
+        batch["message_emojis"].append(
+            (message_id, emoji_id, emoji_counts[get_emoji_code(emoji)])
+        )
+
+    # emojis
+    all_emojis = message["inlineEmojis"] + [r["emoji"] for r in message["reactions"]]
+    for emoji in all_emojis:
+        is_native_emoji = emoji["id"] == ""
+        emoji_id = emoji["id"] or emoji["name"]
+        if emoji_id in seen_emojis:
+            continue
+        seen_emojis.add(emoji_id)
+        batch["emojis"].append(
+            (
+                emoji_id,
+                emoji["name"],
+                emoji.get("code", ""),
+                emoji.get("isAnimated", False),
+                is_native_emoji,
+                emoji.get("imageUrl", ""),
             )
-            inline_emojis = orjson.dumps(message["inlineEmojis"])
+        )
+        if is_native_emoji:
+            continue
+        filename = emoji["imageUrl"].rsplit("/", 1)[-1]
+        batch["downloads"].append(
+            (f"emojis/{filename}", emoji["imageUrl"], "emoji", None)
+        )
 
-            t = (
+    # attachments
+    for attachment in message["attachments"]:
+        attachment_id = int(attachment["id"])
+        batch["attachments"].append(
+            (
+                attachment_id,
                 message_id,
-                type,
-                timestamp,
-                content,
-                author_id,
-                author_name,
-                author_nickname,
-                author_discriminator,
-                author_avatar_url,
-                attachments,
-                embeds,
-                stickers,
-                reactions,
-                total_reactions,
-                mentions,
-                inline_emojis,
-                channel_id,
-                channel_name,
-                len(content),
+                attachment["fileName"],
+                formatted_timestamp,
+                pathlib.Path(attachment["fileName"]).suffix,
                 CURRENT_YEAR,
+                get_media_type(pathlib.Path(attachment["fileName"]).suffix),
             )
-            conn.cursor().execute(
-                f"INSERT OR REPLACE INTO messages (message_id, type, timestamp, content, author_id, author_name, author_nickname, author_discriminator, author_avatar_url, attachments, embeds, stickers, reactions, total_reactions, mentions, inline_emojis, channel_id, channel_name, content_length, year) VALUES "
-                + f"(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                t,
+        )
+        batch["downloads"].append(
+            (
+                f"attachments/{attachment_id}_{attachment['fileName']}",
+                attachment["url"],
+                "attachment",
+                attachment_id,
             )
+        )
 
-            # emojis
-            all_emojis = message["inlineEmojis"] + [
-                r["emoji"] for r in message["reactions"]
-            ]
-            for emoji in all_emojis:
-                is_native_emoji = emoji["id"] == ""
-                emoji_id = emoji["id"] or emoji["name"]
-                if is_native_emoji or emoji_id in seen_emojis:
-                    continue
-                seen_emojis.add(emoji_id)
-                filename = emoji["imageUrl"].rsplit("/", 1)[-1]
-                print(f"Writing emoji {emoji_id} {filename}")
-                with open(f"emojis/{filename}", "wb+") as emoji_file:
-                    res = requests.get(emoji["imageUrl"])
-                    emoji_file.write(res.content)
-
-            # attachments
-            for attachment in message["attachments"]:
-                try:
-                    print(
-                        f"Writing attachment {attachment['id']} {attachment['fileName']} {attachment["url"]}"
-                    )
-                    with open(
-                        f"attachments/{attachment['id']}_{attachment['fileName']}",
-                        "wb+",
-                    ) as attachment_file:
-                        res = requests.get(attachment["url"], timeout=5)
-                        res.raise_for_status()
-                        attachment_file.write(res.content)
-
-                    conn.cursor().execute(
-                        f"INSERT OR REPLACE INTO attachments (id, related_message_id, file_name, timestamp, extension, year) VALUES (?, ?, ?, ?, ?, ?)",
-                        (
-                            int(attachment["id"]),
-                            message_id,
-                            attachment["fileName"],
-                            formatted_timestamp,
-                            pathlib.Path(attachment["fileName"]).suffix,
-                            CURRENT_YEAR,
-                        ),
+
+def iter_file_batches(path: str, previous: tuple | None = None):
+    # previous is this file's manifest row (size, mtime, content_hash,
+    # max_message_id, status) from an earlier run
+    file_name = os.path.basename(path)
+    stat = os.stat(path)
+    size, mtime = stat.st_size, int(stat.st_mtime)
+    if previous and previous[4] == "done" and previous[:2] == (size, mtime):
+        print(f"Skipping unchanged file - {file_name}")
+        return
+
+    content_hash = hash_file(path)
+    if previous and previous[4] == "done" and previous[2] == content_hash:
+        print(f"Skipping unchanged file - {file_name}")
+        yield defaultdict(
+            list,
+            manifest=[(file_name, size, mtime, content_hash, previous[3], "done")],
+        )
+        return
+
+    # exports are in message id order, so everything up to the watermark was
+    # already committed by an earlier (possibly interrupted) run
+    watermark = previous[3] if previous else 0
+    max_message_id = watermark
+
+    channel = read_channel(path)
+    channel_id = int(channel.get("id", "0"))
+    channel_name = channel.get("name")
+    print(f"Streaming messages - {channel_id} - {channel_name}")
+    if watermark:
+        print(f"Resuming after message {watermark}")
+
+    batch = defaultdict(list)
+    message_count = 0
+    for message in iter_messages(path):
+        message_count += 1
+        message_id = int(message["id"])
+        if message_id <= watermark:
+            continue
+        max_message_id = max(max_message_id, message_id)
+        parse_message(message, channel_id, channel_name, batch)
+
+        if len(batch["messages"]) >= BATCH_SIZE:
+            print(f"Process {message_count} - {channel_id} - {channel_name}")
+            batch["manifest"].append(
+                (file_name, size, mtime, content_hash, max_message_id, "partial")
+            )
+            yield batch
+            batch = defaultdict(list)
+
+    batch["manifest"].append(
+        (file_name, size, mtime, content_hash, max_message_id, "done")
+    )
+    yield batch
+
+
+def load_manifest(conn: sqlite3.Connection) -> dict:
+    return {
+        row[0]: row[1:]
+        for row in conn.execute(
+            "SELECT file_name, size, mtime, content_hash, max_message_id, status FROM ingest_manifest"
+        )
+    }
+
+
+def write_batch(conn: sqlite3.Connection, batch: dict):
+    conn.executemany(
+        "INSERT OR REPLACE INTO messages (message_id, type, timestamp, content, author_id, author_name, author_nickname, author_discriminator, author_avatar_url, attachments, embeds, stickers, reactions, total_reactions, mentions, inline_emojis, channel_id, channel_name, content_length, year, has_link, mention_count, reaction_kinds, day_bucket, hour_of_day) VALUES "
+        + "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        batch["messages"],
+    )
+    conn.executemany(
+        "INSERT INTO attachments (id, related_message_id, file_name, timestamp, extension, year, media_type) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        + "ON CONFLICT (id) DO UPDATE SET related_message_id = excluded.related_message_id, file_name = excluded.file_name, timestamp = excluded.timestamp, extension = excluded.extension, year = excluded.year, media_type = excluded.media_type",
+        batch["attachments"],
+    )
+    message_ids = [(row[0],) for row in batch["messages"]]
+    for table in ("message_reactions", "message_mentions", "message_emojis"):
+        conn.executemany(f"DELETE FROM {table} WHERE message_id = ?", message_ids)
+    conn.executemany(
+        "INSERT OR IGNORE INTO message_reactions (message_id, emoji_id, user_id) VALUES (?, ?, ?)",
+        batch["message_reactions"],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO message_mentions (message_id, user_id) VALUES (?, ?)",
+        batch["message_mentions"],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO message_emojis (message_id, emoji_id, count) VALUES (?, ?, ?)",
+        batch["message_emojis"],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO emojis (emoji_id, name, code, animated, native, image_url) VALUES (?, ?, ?, ?, ?, ?)",
+        batch["emojis"],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO members (user_id, name, nickname, avatar_url, is_bot) VALUES (?, ?, ?, ?, ?)",
+        {row[0]: row for row in batch["members"]}.values(),
+    )
+    enqueue_downloads(conn, batch["downloads"])
+    # the manifest row is committed with the rows it describes, so a crash
+    # resumes from the last committed batch
+    conn.executemany(
+        "INSERT OR REPLACE INTO ingest_manifest (file_name, size, mtime, content_hash, max_message_id, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(*row, int(time.time())) for row in batch["manifest"]],
+    )
+    conn.commit()
+    # year is the 20th message column
+    return {row[19] for row in batch["messages"]}
+
+
+def ingest_worker(task_queue, result_queue):
+    # parses whole files and hands row batches back to the single writer; the
+    # result queue is bounded so a slow writer applies backpressure
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        path, previous = task
+        result_queue.put(("start", path, os.getpid()))
+        try:
+            for batch in iter_file_batches(path, previous):
+                result_queue.put(("batch", path, dict(batch)))
+            result_queue.put(("done", path, None))
+        except Exception:
+            result_queue.put(("error", path, traceback.format_exc()))
+
+
+def ingest_serial(conn: sqlite3.Connection, tasks: list[tuple]) -> tuple[int, set]:
+    total_rows = 0
+    touched_years = set()
+    for i, (path, previous) in enumerate(tasks):
+        print(f"Processing file {i + 1}/{len(tasks)} - {path}")
+        start_time = time.time()
+        row_count = 0
+        for batch in iter_file_batches(path, previous):
+            touched_years |= write_batch(conn, batch)
+            row_count += len(batch["messages"])
+        total_rows += row_count
+        print(
+            f"Done - {row_count} messages in {int(time.time() - start_time)} second(s)"
+        )
+
+    return total_rows, touched_years
+
+
+def ingest_parallel(
+    conn: sqlite3.Connection, tasks: list[tuple], workers: int
+) -> tuple[int, set]:
+    task_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue(maxsize=workers * 4)
+    for task in tasks:
+        task_queue.put(task)
+    for _ in range(workers):
+        task_queue.put(None)
+
+    processes = [
+        multiprocessing.Process(
+            target=ingest_worker, args=(task_queue, result_queue), daemon=True
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    finished = 0
+    row_counts = defaultdict(int)
+    touched_years = set()
+    # the file each worker is on, to name it if the worker dies without
+    # reporting an error (killed, out of memory, crashed in native code)
+    current_paths = {}
+    while finished < len(tasks):
+        try:
+            kind, path, payload = result_queue.get(timeout=WORKER_POLL_SECONDS)
+        except queue.Empty:
+            for process in processes:
+                if process.exitcode not in (None, 0):
+                    path = current_paths.get(process.pid)
+                    for other in processes:
+                        other.terminate()
+                    raise RuntimeError(
+                        f"Ingest worker {process.pid} exited with code {process.exitcode} while processing {path}"
                     )
-                except Exception as e:
-                    print(f"Error getting attachment: {str(e)}")
+            if not any(process.is_alive() for process in processes):
+                raise RuntimeError(
+                    f"Ingest workers exited with {len(tasks) - finished} file(s) unfinished"
+                )
+            continue
+
+        if kind == "start":
+            current_paths[payload] = path
+            continue
+        if kind == "batch":
+            batch = defaultdict(list, payload)
+            touched_years |= write_batch(conn, batch)
+            row_counts[path] += len(batch["messages"])
+            continue
+
+        finished += 1
+        if kind == "error":
+            print(f"Error processing {path}:\n{payload}")
+        else:
+            print(
+                f"Done {finished}/{len(tasks)} - {path} - {row_counts[path]} messages"
+            )
+
+    for process in processes:
+        process.join()
+
+    return sum(row_counts.values()), touched_years
+
+
+def main():
+    print("Current year:", CURRENT_YEAR)
+
+    export_directories = {"attachments", "emojis", "avatars"}
+    for directory in export_directories:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect("backend/wrapped.db")
+    ensure_tables(conn)
+    backfill_derived_columns(conn)
+    manifest = {} if INGEST_FORCE else load_manifest(conn)
+    tasks = [
+        (os.path.join(EXPORT_DIR, file_name), manifest.get(file_name))
+        for file_name in list_export_files(EXPORT_DIR)
+    ]
+    ingest_stamp = get_ingest_stamp(conn)
+    if BULK_LOAD:
+        print("Bulk load mode, dropping secondary indexes")
+        previous_pragmas = begin_bulk_load(conn)
+
+    start_time = time.time()
+    try:
+        if INGEST_WORKERS > 1:
+            print(f"Ingesting {len(tasks)} file(s) with {INGEST_WORKERS} workers")
+            row_count, touched_years = ingest_parallel(conn, tasks, INGEST_WORKERS)
+        else:
+            row_count, touched_years = ingest_serial(conn, tasks)
+    finally:
+        if BULK_LOAD:
+            end_bulk_load(conn, previous_pragmas)
+
+    elapsed = time.time() - start_time
+    print(
+        f"Ingested {row_count} messages from {len(tasks)} file(s) in {elapsed:.1f} second(s)"
+        + f" ({row_count / max(elapsed, 1e-9):.0f} rows/sec)"
+    )
+
+    if WRITE_SIDECAR:
+        write_sidecars(conn, touched_years, ingest_stamp)
+
+    if DOWNLOAD_MEDIA:
+        asyncio.run(run_downloads(conn))
+
+    conn.close()
+
 
-        conn.commit()
-        print("Done")
+if __name__ == "__main__":
+    main()
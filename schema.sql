@@ -6,11 +6,15 @@ CREATE TABLE IF NOT EXISTS "attachments" (
 	"timestamp"	INTEGER,
 	"extension"	TEXT,
 	"year" INTEGER,
+	"content_hash"	TEXT,
+	"size"	INTEGER,
+	"media_type"	TEXT,
+	"missing"	INTEGER DEFAULT 0
 );
 CREATE TABLE IF NOT EXISTS "likes" (
 	"attachment_id"	INTEGER,
 	"discord_id"	INTEGER,
-	"timestamp"	INTEGER,
+	"timestamp"	INTEGER
 );
 CREATE TABLE IF NOT EXISTS "message_likes" (
 	"message_id"	INTEGER,
@@ -38,6 +42,11 @@ CREATE TABLE IF NOT EXISTS "messages" (
 	"channel_name"	TEXT,
 	"content_length"	INTEGER,
 	"year" INTEGER,
+	"has_link"	INTEGER,
+	"mention_count"	INTEGER,
+	"reaction_kinds"	INTEGER,
+	"day_bucket"	INTEGER,
+	"hour_of_day"	INTEGER,
 	PRIMARY KEY("message_id")
 );
 CREATE TABLE IF NOT EXISTS "users" (
@@ -61,13 +70,18 @@ CREATE TABLE IF NOT EXISTS "users" (
 	"most_mentioned_received_count"	INTEGER,
 	"emoji_data" BLOB,
 	"year" INTEGER,
+	"msg_frequency"	BLOB
 );
-CREATE TABLE IF NOT EXISTS "static" ("key" TEXT, "value" BLOB, "year" INTEGER)
+CREATE INDEX IF NOT EXISTS "idx_users_year_user_id" ON "users" (
+	"year",
+	"user_id"
+);
+CREATE TABLE IF NOT EXISTS "static" ("key" TEXT, "value" BLOB, "year" INTEGER);
 CREATE UNIQUE INDEX IF NOT EXISTS "idx_key_year" ON "static" (
 	"key",
 	"year"
 );
-CREATE TABLE IF NOT EXISTS "word_usage" ("word" TEXT, "data" BLOB, "year" INTEGER)
+CREATE TABLE IF NOT EXISTS "word_usage" ("word" TEXT, "data" BLOB, "year" INTEGER);
 CREATE UNIQUE INDEX IF NOT EXISTS "idx_word_year" ON "word_usage" (
 	"word",
 	"year"
@@ -91,5 +105,144 @@ CREATE INDEX IF NOT EXISTS "idx_messages_total_reactions" ON "messages" (
 );
 CREATE INDEX IF NOT EXISTS "idx_messages_year" ON "messages" (
 	"year"
-)
+);
+CREATE INDEX IF NOT EXISTS "idx_messages_year_has_link_content_length" ON "messages" (
+	"year",
+	"has_link",
+	"content_length"
+);
+CREATE INDEX IF NOT EXISTS "idx_messages_year_day_bucket" ON "messages" (
+	"year",
+	"day_bucket"
+);
+CREATE INDEX IF NOT EXISTS "idx_attachments_year_media_type" ON "attachments" (
+	"year",
+	"media_type"
+);
+CREATE TABLE IF NOT EXISTS "downloads" (
+	"path"	TEXT,
+	"url"	TEXT,
+	"kind"	TEXT,
+	"ref_id"	INTEGER,
+	"status"	TEXT,
+	"attempts"	INTEGER,
+	"error"	TEXT,
+	"updated_at"	INTEGER,
+	"content_hash"	TEXT,
+	"size"	INTEGER,
+	PRIMARY KEY("path")
+);
+CREATE INDEX IF NOT EXISTS "idx_downloads_status_url" ON "downloads" (
+	"status",
+	"url"
+);
+CREATE TABLE IF NOT EXISTS "ingest_manifest" (
+	"file_name"	TEXT,
+	"size"	INTEGER,
+	"mtime"	INTEGER,
+	"content_hash"	TEXT,
+	"max_message_id"	INTEGER,
+	"status"	TEXT,
+	"updated_at"	INTEGER,
+	PRIMARY KEY("file_name")
+);
+CREATE TABLE IF NOT EXISTS "message_reactions" (
+	"message_id"	INTEGER,
+	"emoji_id"	TEXT,
+	"user_id"	INTEGER,
+	PRIMARY KEY("message_id","emoji_id","user_id")
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS "idx_message_reactions_user_id" ON "message_reactions" (
+	"user_id"
+);
+CREATE INDEX IF NOT EXISTS "idx_message_reactions_emoji_id" ON "message_reactions" (
+	"emoji_id"
+);
+CREATE TABLE IF NOT EXISTS "message_mentions" (
+	"message_id"	INTEGER,
+	"user_id"	INTEGER,
+	PRIMARY KEY("message_id","user_id")
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS "idx_message_mentions_user_id" ON "message_mentions" (
+	"user_id"
+);
+CREATE TABLE IF NOT EXISTS "message_emojis" (
+	"message_id"	INTEGER,
+	"emoji_id"	TEXT,
+	"count"	INTEGER,
+	PRIMARY KEY("message_id","emoji_id")
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS "idx_message_emojis_emoji_id" ON "message_emojis" (
+	"emoji_id"
+);
+CREATE TABLE IF NOT EXISTS "emojis" (
+	"emoji_id"	TEXT,
+	"name"	TEXT,
+	"code"	TEXT,
+	"animated"	INTEGER,
+	"native"	INTEGER,
+	"image_url"	TEXT,
+	PRIMARY KEY("emoji_id")
+);
+CREATE TABLE IF NOT EXISTS "members" (
+	"user_id"	INTEGER,
+	"name"	TEXT,
+	"nickname"	TEXT,
+	"avatar_url"	TEXT,
+	"is_bot"	INTEGER,
+	PRIMARY KEY("user_id")
+);
+CREATE TABLE IF NOT EXISTS "mention_edges" (
+	"year"	INTEGER,
+	"from_user_id"	INTEGER,
+	"to_user_id"	INTEGER,
+	"from_name"	TEXT,
+	"to_name"	TEXT,
+	"count"	INTEGER,
+	"first_message_id"	INTEGER,
+	"first_position"	INTEGER,
+	PRIMARY KEY("year","from_user_id","to_user_id")
+);
+CREATE INDEX IF NOT EXISTS "idx_mention_edges_year_count" ON "mention_edges" (
+	"year",
+	"count"
+);
+CREATE INDEX IF NOT EXISTS "idx_mention_edges_year_from_count" ON "mention_edges" (
+	"year",
+	"from_user_id",
+	"count"
+);
+CREATE INDEX IF NOT EXISTS "idx_mention_edges_year_to_count" ON "mention_edges" (
+	"year",
+	"to_user_id",
+	"count"
+);
+CREATE TABLE IF NOT EXISTS "like_counts" (
+	"is_attachment"	INTEGER,
+	"entity_id"	INTEGER,
+	"count"	INTEGER,
+	PRIMARY KEY("is_attachment","entity_id")
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS "likes_count_insert" AFTER INSERT ON "likes" BEGIN
+	INSERT INTO like_counts VALUES (1, NEW.attachment_id, 1) ON CONFLICT (is_attachment, entity_id) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS "likes_count_delete" AFTER DELETE ON "likes" BEGIN
+	UPDATE like_counts SET count = count - 1 WHERE is_attachment = 1 AND entity_id = OLD.attachment_id;
+	DELETE FROM like_counts WHERE is_attachment = 1 AND entity_id = OLD.attachment_id AND count <= 0;
+END;
+CREATE TRIGGER IF NOT EXISTS "message_likes_count_insert" AFTER INSERT ON "message_likes" BEGIN
+	INSERT INTO like_counts VALUES (0, NEW.message_id, 1) ON CONFLICT (is_attachment, entity_id) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS "message_likes_count_delete" AFTER DELETE ON "message_likes" BEGIN
+	UPDATE like_counts SET count = count - 1 WHERE is_attachment = 0 AND entity_id = OLD.message_id;
+	DELETE FROM like_counts WHERE is_attachment = 0 AND entity_id = OLD.message_id AND count <= 0;
+END;
+CREATE TABLE IF NOT EXISTS "aggregate_watermarks" (
+	"year"	INTEGER,
+	"name"	TEXT,
+	"max_message_id"	INTEGER,
+	"message_count"	INTEGER,
+	"updated_at"	INTEGER,
+	PRIMARY KEY("year","name")
+);
 COMMIT;
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+import orjson
+
+# per year columnar copy of the numeric message columns, one .npy file per
+# column in message id order, so they can be memory mapped and scanned without
+# going through sqlite. meta.json records the message count and max message id
+# the files were built from, and the ingest manifest at the time; a sidecar
+# that doesn't match the database is ignored. it lives outside backend/, which
+# never reads it, so it isn't copied into the backend image
+SIDECAR_DIR = os.environ.get("SIDECAR_DIR", "sidecar")
+SIDECAR_VERSION = 2
+SIDECAR_COLUMNS = {
+    "message_id": ("message_id", np.int64),
+    "timestamp": ("timestamp", np.int64),
+    "author_id": ("COALESCE(author_id, 0)", np.int64),
+    "channel_id": ("COALESCE(channel_id, 0)", np.int64),
+    "total_reactions": ("COALESCE(total_reactions, 0)", np.int32),
+    "content_length": ("COALESCE(content_length, 0)", np.int32),
+    "mention_count": ("COALESCE(mention_count, 0)", np.int32),
+    "attachment_count": (
+        "COALESCE(json_array_length(CAST(attachments AS TEXT)), 0)",
+        np.int32,
+    ),
+}
+# computed from timestamp with the same rules as derived.py
+DERIVED_COLUMNS = {"day_bucket", "hour_of_day"}
+FETCH_ROWS = 100000
+
+
+def get_sidecar_dir(year: int) -> str:
+    return os.path.join(SIDECAR_DIR, str(year))
+
+
+def get_stamp(conn: sqlite3.Connection, year: int) -> tuple[int, int]:
+    return conn.execute(
+        "SELECT COUNT(*), COALESCE(MAX(message_id), 0) FROM messages WHERE year = ?",
+        (year,),
+    ).fetchone()
+
+
+def get_ingest_stamp(conn: sqlite3.Connection) -> str:
+    # changes whenever process.py ingests a new or changed export file, which
+    # can rewrite messages in place without changing their count or max id
+    digest = hashlib.sha256()
+    for row in conn.execute(
+        "SELECT file_name, content_hash, max_message_id, status FROM ingest_manifest ORDER BY file_name"
+    ):
+        digest.update(orjson.dumps(row))
+    return digest.hexdigest()
+
+
+def read_meta(year: int) -> dict | None:
+    try:
+        with open(os.path.join(get_sidecar_dir(year), "meta.json"), "rb") as f:
+            return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return None
+
+
+def is_current(meta: dict | None, stamp: tuple[int, int], ingest_stamp: str) -> bool:
+    return (
+        meta is not None
+        and meta["version"] == SIDECAR_VERSION
+        and (meta["message_count"], meta["max_message_id"]) == tuple(stamp)
+        and meta["ingest_stamp"] == ingest_stamp
+    )
+
+
+def write_meta(directory: str, stamp: tuple[int, int], ingest_stamp: str):
+    count, max_message_id = stamp
+    temp_path = os.path.join(directory, "meta.json.tmp")
+    with open(temp_path, "wb") as f:
+        f.write(
+            orjson.dumps(
+                {
+                    "version": SIDECAR_VERSION,
+                    "message_count": count,
+                    "max_message_id": max_message_id,
+                    "ingest_stamp": ingest_stamp,
+                    "columns": list(SIDECAR_COLUMNS),
+                }
+            )
+        )
+    os.replace(temp_path, os.path.join(directory, "meta.json"))
+
+
+def write_sidecar(
+    conn: sqlite3.Connection, year: int, stamp: tuple[int, int], ingest_stamp: str
+):
+    count, max_message_id = stamp
+    directory = get_sidecar_dir(year)
+    temp_directory = f"{directory}.tmp"
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+
+    arrays = {
+        column: np.lib.format.open_memmap(
+            os.path.join(temp_directory, f"{column}.npy"),
+            mode="w+",
+            dtype=dtype,
+            shape=(count,),
+        )
+        for column, (_, dtype) in SIDECAR_COLUMNS.items()
+    }
+    cursor = conn.execute(
+        f"SELECT {', '.join(expression for expression, _ in SIDECAR_COLUMNS.values())} FROM messages WHERE year = ? AND message_id <= ? ORDER BY message_id ASC",
+        (year, max_message_id),
+    )
+    position = 0
+    while rows := cursor.fetchmany(FETCH_ROWS):
+        if position + len(rows) > count:
+            raise RuntimeError(f"Messages for {year} changed while writing sidecar")
+        for column, values in zip(SIDECAR_COLUMNS, zip(*rows)):
+            arrays[column][position : position + len(rows)] = values
+        position += len(rows)
+    if position != count:
+        raise RuntimeError(f"Messages for {year} changed while writing sidecar")
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    # meta.json goes in last, a sidecar without it is never read
+    write_meta(temp_directory, stamp, ingest_stamp)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp_directory, directory)
+
+
+def write_sidecars(
+    conn: sqlite3.Connection, touched_years: set, previous_ingest_stamp: str
+):
+    # touched_years had messages written by this ingest, possibly in place.
+    # other years only need their meta moved to the new ingest stamp, if they
+    # were current before it
+    ingest_stamp = get_ingest_stamp(conn)
+    for year, count, max_message_id in conn.execute(
+        "SELECT year, COUNT(*), MAX(message_id) FROM messages GROUP BY year"
+    ).fetchall():
+        stamp = (count, max_message_id)
+        meta = read_meta(year)
+        if year not in touched_years:
+            if is_current(meta, stamp, ingest_stamp):
+                continue
+            if is_current(meta, stamp, previous_ingest_stamp):
+                write_meta(get_sidecar_dir(year), stamp, ingest_stamp)
+                continue
+        print(f"Writing sidecar for {year} ({count} messages)")
+        write_sidecar(conn, year, stamp, ingest_stamp)
+
+
+def open_sidecar(conn: sqlite3.Connection, year: int) -> dict | None:
+    if not is_current(read_meta(year), get_stamp(conn, year), get_ingest_stamp(conn)):
+        return None
+    directory = get_sidecar_dir(year)
+    return {
+        column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode="r")
+        for column in SIDECAR_COLUMNS
+    }
+
+
+def get_sidecar_range(sidecar: dict, id_range: tuple) -> tuple[int, int]:
+    # positions of a [low, high) message id range
+    message_ids = sidecar["message_id"]
+    low, high = id_range
+    start = 0 if low is None else int(np.searchsorted(message_ids, low))
+    stop = len(message_ids) if high is None else int(np.searchsorted(message_ids, high))
+    return start, stop
+
+
+def get_sidecar_arrays(sidecar: dict, start: int, stop: int, wanted: set) -> dict:
+    arrays = {}
+    timestamps = sidecar["timestamp"][start:stop]
+    for column in wanted:
+        if column == "day_bucket":
+            arrays[column] = timestamps - timestamps % 86400
+        elif column == "hour_of_day":
+            arrays[column] = timestamps // 3600 % 24
+        else:
+            arrays[column] = sidecar[column][start:stop]
+    return arrays
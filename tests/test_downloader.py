@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import sys
+
+from aiohttp import web
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import downloader
+from downloader import enqueue_downloads, get_blob_path, run_downloads
+
+CONTENT = b"attachment content"
+
+
+async def handle(request: web.Request) -> web.Response:
+    name = request.match_info["name"]
+    if name == "gone":
+        return web.Response(status=404)
+    if name == "broken":
+        return web.Response(status=500)
+    return web.Response(body=CONTENT)
+
+
+def create_database(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    with open(os.path.join(ROOT_DIR, "schema.sql")) as f:
+        conn.executescript(f.read())
+    return conn
+
+
+async def download_all(conn: sqlite3.Connection, names: list[str]):
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    host, port = runner.addresses[0][:2]
+    try:
+        enqueue_downloads(
+            conn,
+            [
+                (
+                    f"attachments/{ref_id}_{name}.png",
+                    f"http://{host}:{port}/{name}",
+                    "attachment",
+                    ref_id,
+                )
+                for ref_id, name in enumerate(names)
+            ],
+        )
+        conn.commit()
+        return await run_downloads(conn, concurrency=2, retries=1, timeout=5)
+    finally:
+        await runner.cleanup()
+
+
+def test_run_downloads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(downloader, "RETRY_BACKOFF", 0)
+    os.makedirs("attachments")
+    conn = create_database("wrapped.db")
+    names = ["ok", "gone", "broken"]
+    conn.executemany(
+        "INSERT INTO attachments (id, file_name, year, extension) VALUES (?, ?, 2025, '.png')",
+        [(ref_id, f"{name}.png") for ref_id, name in enumerate(names)],
+    )
+
+    done, failed = asyncio.run(download_all(conn, names))
+
+    assert (done, failed) == (1, 2)
+    statuses = dict(conn.execute("SELECT ref_id, status FROM downloads"))
+    assert statuses == {0: "done", 1: "gone", 2: "failed"}
+    missing = dict(conn.execute("SELECT id, missing FROM attachments"))
+    assert missing == {0: 0, 1: 1, 2: 1}
+
+    content_hash = hashlib.sha256(CONTENT).hexdigest()
+    assert conn.execute(
+        "SELECT content_hash, size FROM attachments WHERE id = 0"
+    ).fetchone() == (content_hash, len(CONTENT))
+    with open(get_blob_path(content_hash, ".png"), "rb") as f:
+        assert f.read() == CONTENT
+    assert sorted(os.listdir("attachments")) == [f"{content_hash}.png"]
+    conn.close()
@@ -0,0 +1,66 @@
+import ast
+import os
+import re
+import sqlite3
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from db import LIKE_COUNT_TRIGGERS, ensure_like_counts
+
+
+def load_schema() -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    with open(os.path.join(ROOT_DIR, "schema.sql")) as f:
+        conn.executescript(f.read())
+    return conn
+
+
+def drop_like_counts(conn: sqlite3.Connection):
+    for name in LIKE_COUNT_TRIGGERS:
+        conn.execute(f'DROP TRIGGER "{name}"')
+    conn.execute('DROP TABLE "like_counts"')
+
+
+def get_like_count_schema(conn: sqlite3.Connection) -> dict:
+    # sqlite keeps the statement text as written, so layout is ignored
+    return {
+        name: re.sub(r"\s*([(),;])\s*", r"\1", re.sub(r"\s+", " ", sql))
+        for name, sql in conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE name = 'like_counts' OR type = 'trigger'"
+        )
+    }
+
+
+def load_backend_constants() -> dict:
+    # read from the source, importing the backend needs its config and secrets
+    with open(os.path.join(ROOT_DIR, "backend", "async_db.py")) as f:
+        tree = ast.parse(f.read())
+    names = {"LIKE_COUNTS_TABLE", "LIKE_COUNT_TRIGGERS"}
+    return {
+        node.targets[0].id: ast.literal_eval(node.value)
+        for node in tree.body
+        if isinstance(node, ast.Assign)
+        and isinstance(node.targets[0], ast.Name)
+        and node.targets[0].id in names
+    }
+
+
+def test_like_counts_match_schema():
+    expected = get_like_count_schema(load_schema())
+    assert set(expected) == {"like_counts", *LIKE_COUNT_TRIGGERS}
+
+    conn = load_schema()
+    drop_like_counts(conn)
+    ensure_like_counts(conn)
+    assert get_like_count_schema(conn) == expected
+
+    constants = load_backend_constants()
+    assert constants["LIKE_COUNT_TRIGGERS"] == LIKE_COUNT_TRIGGERS
+    conn = load_schema()
+    drop_like_counts(conn)
+    conn.execute(constants["LIKE_COUNTS_TABLE"])
+    for trigger_sql in constants["LIKE_COUNT_TRIGGERS"].values():
+        conn.execute(trigger_sql)
+    assert get_like_count_schema(conn) == expected
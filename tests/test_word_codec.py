@@ -0,0 +1,69 @@
+import importlib.util
+import os
+import struct
+import sys
+
+import orjson
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from word_codec import DAY_SECONDS, decode_word_usage, encode_word_usage
+
+
+def load_backend_decoder():
+    # by path, so the backend's modules don't shadow the processing scripts'
+    spec = importlib.util.spec_from_file_location(
+        "backend_word_usage", os.path.join(ROOT_DIR, "backend", "word_usage.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.decode_word_usage
+
+
+backend_decode_word_usage = load_backend_decoder()
+
+SAMPLES = [
+    {"total": 0, "buckets": {}},
+    {"total": 3, "buckets": {str(19000 * DAY_SECONDS): 3}},
+    {
+        "total": 12,
+        "buckets": {
+            str(19723 * DAY_SECONDS): 5,
+            str(19724 * DAY_SECONDS): 1,
+            str(20088 * DAY_SECONDS): 6,
+        },
+    },
+    # counts past u16 switch the blob to u32 counts
+    {
+        "total": 70001,
+        "buckets": {str(19723 * DAY_SECONDS): 70000, str(19800 * DAY_SECONDS): 1},
+    },
+]
+
+
+def test_round_trip():
+    for data in SAMPLES:
+        assert decode_word_usage(encode_word_usage(data)) == data
+
+
+def test_little_endian_layout():
+    blob = encode_word_usage(SAMPLES[3])
+    assert blob == (
+        struct.pack("<BBIII", 1, 4, 70001, 19723, 2)
+        + struct.pack("<2H", 0, 77)
+        + struct.pack("<2I", 70000, 1)
+    )
+
+
+def test_backend_decoder_matches():
+    blobs = [encode_word_usage(data) for data in SAMPLES]
+    # rows written before the binary encoding
+    blobs.append(orjson.dumps(SAMPLES[2]))
+    for blob in blobs:
+        data = decode_word_usage(blob)
+        total, days = backend_decode_word_usage(blob)
+        assert total == data["total"]
+        assert days == [
+            (int(bucket), count) for bucket, count in data["buckets"].items()
+        ]
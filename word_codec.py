@@ -0,0 +1,57 @@
+import struct
+
+import orjson
+
+# word_usage.data layout, little endian:
+#   header: version (u8), count width in bytes (u8), total (u32), first day
+#           (u32, days since the epoch), number of days (u32)
+#   days: u16 offsets from the first day, ascending
+#   counts: u16 or u32 per day, the width from the header
+# backend/word_usage.py has a copy of the decoder, keep them in sync. the
+# arrays are packed with struct rather than array, whose byte order and item
+# sizes are the machine's
+WORD_USAGE_VERSION = 1
+WORD_USAGE_HEADER = struct.Struct("<BBIII")
+DAY_SECONDS = 86400
+# count width in bytes to its struct format character
+COUNT_FORMATS = {2: "H", 4: "I"}
+
+
+def encode_word_usage(data: dict) -> bytes:
+    days = sorted(
+        (int(bucket) // DAY_SECONDS, count) for bucket, count in data["buckets"].items()
+    )
+    first_day = days[0][0] if days else 0
+    counts = [count for _, count in days]
+    width = 2 if not counts or max(counts) < 1 << 16 else 4
+    return (
+        WORD_USAGE_HEADER.pack(
+            WORD_USAGE_VERSION,
+            width,
+            data["total"],
+            first_day,
+            len(days),
+        )
+        + struct.pack(f"<{len(days)}H", *(day - first_day for day, _ in days))
+        + struct.pack(f"<{len(counts)}{COUNT_FORMATS[width]}", *counts)
+    )
+
+
+def decode_word_usage(blob: bytes) -> dict:
+    # rows written before the binary encoding are JSON
+    if blob[:1] == b"{":
+        return orjson.loads(blob)
+
+    _, width, total, first_day, length = WORD_USAGE_HEADER.unpack_from(blob)
+    start = WORD_USAGE_HEADER.size
+    offsets = struct.unpack_from(f"<{length}H", blob, start)
+    counts = struct.unpack_from(
+        f"<{length}{COUNT_FORMATS[width]}", blob, start + length * 2
+    )
+    return {
+        "total": total,
+        "buckets": {
+            str((first_day + offset) * DAY_SECONDS): count
+            for offset, count in zip(offsets, counts)
+        },
+    }